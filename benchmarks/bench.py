@@ -0,0 +1,290 @@
+"""
+Benchmarks for field cleaning and widget rendering.
+
+Run from the repository root:
+    python benchmarks/bench.py                # run and print results
+    python benchmarks/bench.py --save         # also save them as the baseline
+    python benchmarks/bench.py --compare      # fail on regressions
+    python benchmarks/bench.py clean_ radio_  # only run matching cases
+
+URL fetches go to a local HTTP server and uploads to a FileSystemStorage in a
+temporary directory, so no network access is needed.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'xorformfields.test_settings')
+
+import django
+django.setup()
+
+from django.test.utils import override_settings
+# the local server is on loopback, which fetches refuse by default
+override_settings(XORFORMFIELDS_RESOLVER={
+    'OPTIONS': {'allow': ['127.0.0.0/8']}}).enable()
+
+from django import forms
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from xorformfields.forms import (
+    FileOrURLField, FileOrURLWidget, MutuallyExclusiveRadioWidget,
+    MutuallyExclusiveValueField)
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+PAYLOAD_SIZE = 64 * 2 ** 10
+
+CASES = []
+
+
+def case(name, iterations=1000):
+    """ Registers a function that sets a case up and returns its callable """
+    def register(setup):
+        CASES.append((name, iterations, setup))
+        return setup
+    return register
+
+
+class PayloadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        size = int(self.path.rsplit('/', 1)[-1])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        self.wfile.write(b'x' * size)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Environment(object):
+    """ Local stand-ins for a remote HTTP server and storage """
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PayloadHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.directory = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(self.directory, '/media/')
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+for n in (2, 5, 10):
+    for short_circuit in (False, True):
+        def clean_setup(env, n=n, short_circuit=short_circuit):
+            field = MutuallyExclusiveValueField(
+                fields=[forms.IntegerField() for _ in range(n)],
+                short_circuit=short_circuit)
+            value = [''] * (n - 1) + ['42']
+            return lambda: field.clean(value)
+        case('clean_%d_subfields%s' % (
+            n, '_short_circuit' if short_circuit else ''), 5000)(clean_setup)
+
+
+def import_rows(n=1000):
+    return [['', str(i), ''] if i % 3 else [str(i), '', ''] for i in range(n)]
+
+
+@case('clean_many_1000_rows', 20)
+def clean_many_rows(env):
+    field = MutuallyExclusiveValueField(
+        fields=[forms.IntegerField() for _ in range(3)])
+    rows = import_rows()
+    return lambda: field.clean_many(rows)
+
+
+@case('form_per_row_1000_rows', 20)
+def form_per_row(env):
+    class RowForm(forms.Form):
+        value = MutuallyExclusiveValueField(
+            fields=[forms.IntegerField() for _ in range(3)])
+    rows = [dict(('value_%d' % i, v) for i, v in enumerate(row))
+            for row in import_rows()]
+
+    def run():
+        for row in rows:
+            RowForm(row).is_valid()
+    return run
+
+
+@case('formset_construction_100_forms', 20)
+def formset_construction(env):
+    choices = [(i, 'Choice %d' % i) for i in range(50)]
+
+    class AlternativesForm(forms.Form):
+        value = MutuallyExclusiveValueField(fields=[
+            forms.TypedChoiceField(choices=choices, coerce=int),
+            forms.IntegerField(),
+            forms.CharField(),
+        ])
+        image = FileOrURLField(widget=FileOrURLWidget())
+    AlternativesFormSet = forms.formset_factory(AlternativesForm, extra=100)
+    return lambda: AlternativesFormSet().forms
+
+
+@case('fileorurl_to_none', 5000)
+def fileorurl_to_none(env):
+    field = FileOrURLField()
+    value = ['', env.base_url + '/bytes/%d' % PAYLOAD_SIZE]
+    return lambda: field.clean(value)
+
+
+@case('fileorurl_to_file', 300)
+def fileorurl_to_file(env):
+    field = FileOrURLField(to='file')
+    value = ['', env.base_url + '/bytes/%d' % PAYLOAD_SIZE]
+    return lambda: field.clean(value).close()
+
+
+@case('fileorurl_to_url', 300)
+def fileorurl_to_url(env):
+    field = FileOrURLField(to='url', upload_to='bench', storage=env.storage)
+    payload = b'x' * PAYLOAD_SIZE
+
+    def run():
+        field.clean([SimpleUploadedFile('file.bin', payload), ''])
+    return run
+
+
+@case('value_from_datadict', 20000)
+def value_from_datadict(env):
+    widget = FileOrURLWidget()
+    data = {'test_1': env.base_url + '/bytes/1'}
+    return lambda: widget.value_from_datadict(data, {}, 'test')
+
+
+@case('radio_widget_render', 2000)
+def radio_widget_render(env):
+    widget = MutuallyExclusiveRadioWidget(widgets=[
+        forms.Select(choices=[(1, 1), (2, 2)]),
+        forms.TextInput(attrs={'placeholder': 'Enter a number'}),
+    ])
+    return lambda: widget.render('test', ['', '1'])
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1,
+                int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_case(env, iterations, setup):
+    fn = setup(env)
+    for _ in range(min(iterations // 10 + 1, 50)):
+        fn()
+    timings = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+    timings.sort()
+
+    # tracemalloc slows everything down, measure memory in a separate pass
+    tracemalloc.start()
+    for _ in range(min(iterations, 50)):
+        fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / total,
+        'p50_us': percentile(timings, 50) * 1e6,
+        'p90_us': percentile(timings, 90) * 1e6,
+        'p99_us': percentile(timings, 99) * 1e6,
+        'peak_kb': peak / 1024.0,
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        before = baseline[name]['p50_us']
+        change = (result['p50_us'] - before) / before
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-34s p50 %10.1fus -> %10.1fus (%+.0f%%)%s' % (
+            name, before, result['p50_us'], change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('patterns', nargs='*',
+                        help='only run cases whose name contains one of these')
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='compare the results to the saved baseline')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p50 slowdown before failing (0.2=20%%)')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the number of iterations')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with Environment() as env:
+        print('%-34s %10s %10s %10s %10s %10s' % (
+            'case', 'ops/s', 'p50 us', 'p90 us', 'p99 us', 'peak KB'))
+        for name, iterations, setup in CASES:
+            if args.patterns and not any(p in name for p in args.patterns):
+                continue
+            result = results[name] = run_case(
+                env, max(1, int(iterations * args.scale)), setup)
+            print('%-34s %10.0f %10.1f %10.1f %10.1f %10.1f' % (
+                name, result['ops_per_sec'], result['p50_us'],
+                result['p90_us'], result['p99_us'], result['peak_kb']))
+
+    status = 0
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.tolerance):
+            status = 1
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -30,23 +30,35 @@ setup(
 
         'License :: OSI Approved :: MIT License',
 
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
+        'Framework :: Django',
+        'Framework :: Django :: 3.2',
+        'Framework :: Django :: 4.2',
+        'Framework :: Django :: 5.2',
+
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.0',
-        'Programming Language :: Python :: 3.1',
-        'Programming Language :: Python :: 3.2',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
 
     keywords='django development forms',
 
     packages=['xorformfields', 'xorformfields.forms'],
 
-    install_requires=['django>=1.7', 'requests'],
+    python_requires='>=3.8',
+
+    install_requires=['django>=3.2', 'requests'],
+
+    extras_require={
+        'async': ['httpx'],
+    },
 
     package_data={
-        'xorformfields': ['static/mutually_exclusive_widget.js'],
+        'xorformfields': ['static/mutually_exclusive_widget.js',
+                          'static/chunked_upload.js',
+                          'templates/xorformfields/widgets/*.html'],
     },
 )
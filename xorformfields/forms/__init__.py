@@ -1,2 +1,5 @@
 from .fields import *
 from .widgets import *
+from .files import *
+from .mixins import *
+from .processors import *
@@ -0,0 +1,228 @@
+"""
+Async URL fetching for FileOrURLField, for use from async views under ASGI.
+
+Downloads use httpx when they are given an httpx.AsyncClient, or when httpx
+is installed and the XORFORMFIELDS_RESOLVER is off. Otherwise the blocking
+download runs in a worker thread, through the requests session whose
+connections are pinned to the addresses the resolver checked.
+"""
+import asyncio
+import posixpath
+import weakref
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+
+from ..signals import fetch_finished, timed
+from .fetch import (
+    FetchError, Spool, check_headers, download, get_http_options,
+    DEFAULT_CHUNK_SIZE)
+from .resolver import get_resolver
+
+
+__all__ = ['adownload', 'get_async_client', 'AsyncFileOrURLMixin',
+           'AsyncFormMixin']
+
+MAX_REDIRECTS = 20
+
+# httpx clients are bound to the event loop they were first used on
+_clients = weakref.WeakKeyDictionary()
+
+
+def _import_httpx():
+    # imported on first use, it's optional and slow to import
+    try:
+        import httpx
+    except ImportError:
+        return None
+    return httpx
+
+
+def _timeout(timeout):
+    httpx = _import_httpx()
+    if isinstance(timeout, (list, tuple)):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def get_async_client():
+    """
+    Returns the httpx.AsyncClient shared by fetches on the running event
+    loop, configured from the XORFORMFIELDS_HTTP setting.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        httpx = _import_httpx()
+        options = get_http_options()
+        limits = httpx.Limits(
+            max_connections=options['POOL_MAXSIZE'],
+            max_keepalive_connections=options['POOL_CONNECTIONS'])
+        client = _clients[loop] = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=_timeout(options['TIMEOUT']),
+            transport=httpx.AsyncHTTPTransport(
+                limits=limits, retries=options['RETRIES']))
+    return client
+
+
+async def acheck_address(url, resolver):
+    """
+    Raises FetchAddressBlocked if the host of `url` doesn't pass the policy
+    of `resolver`. httpx connects on its own, so unlike the requests session
+    the connection isn't pinned to the address checked.
+    """
+    parts = urlsplit(url)
+    if parts.hostname:
+        await sync_to_async(resolver.resolve, thread_sensitive=False)(
+            parts.hostname, parts.port)
+
+
+async def aprobe_url(url, client, max_size=None, allowed_content_types=None,
+                     resolver=None, **kwargs):
+    """
+    Async version of fetch.probe_url(). Redirects are only followed without
+    a `resolver`, which would have to check each of them.
+    """
+    try:
+        if resolver is not None:
+            await acheck_address(url, resolver)
+        resp = await client.head(url, follow_redirects=resolver is None,
+                                 **kwargs)
+    except Exception:
+        return
+    if 200 <= resp.status_code < 300:
+        check_headers(resp.headers, max_size, allowed_content_types)
+
+
+async def adownload(url, max_size=None, max_memory_size=None,
+                    chunk_size=DEFAULT_CHUNK_SIZE, client=None, timeout=None,
+                    allowed_content_types=None, probe=False, processors=None):
+    """
+    Async version of fetch.download(), streams `url` into an UploadedFile
+    without blocking the event loop. Without a `client`, the download runs in
+    a worker thread if httpx isn't installed or the XORFORMFIELDS_RESOLVER
+    is on, since only the requests session pins connections to the
+    addresses it checked. With a `client` and the resolver on, the URL and
+    every redirect are checked before they are requested.
+    """
+    resolver = get_resolver()
+    if client is None and (_import_httpx() is None or resolver is not None):
+        return await sync_to_async(download, thread_sensitive=False)(
+            url, max_size=max_size, max_memory_size=max_memory_size,
+            chunk_size=chunk_size, timeout=timeout,
+            allowed_content_types=allowed_content_types, probe=probe,
+            processors=processors)
+    if client is None:
+        client = get_async_client()
+    kwargs = {}
+    if timeout is not None:
+        kwargs['timeout'] = _timeout(timeout)
+    if probe:
+        await aprobe_url(url, client, max_size=max_size,
+                         allowed_content_types=allowed_content_types,
+                         resolver=resolver, **kwargs)
+    if resolver is not None:
+        # redirects are followed here, so each of them gets checked
+        kwargs['follow_redirects'] = False
+    name = posixpath.basename(url)
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            if resolver is not None:
+                await acheck_address(url, resolver)
+            async with client.stream('GET', url, **kwargs) as resp:
+                if (resolver is not None and client.follow_redirects and
+                        resp.has_redirect_location):
+                    url = str(resp.next_request.url)
+                    continue
+                return await _aread(resp, url, name, max_size,
+                                    max_memory_size, chunk_size,
+                                    allowed_content_types, processors)
+        raise FetchError(url)
+    except (FetchError, ValidationError):
+        raise
+    except Exception:
+        raise FetchError(url)
+
+
+async def _aread(resp, url, name, max_size, max_memory_size, chunk_size,
+                 allowed_content_types, processors):
+    if not (200 <= resp.status_code < 400):
+        raise FetchError(url)
+    check_headers(resp.headers, max_size, allowed_content_types)
+    spool = Spool(name, resp.headers.get('content-type'),
+                  max_size=max_size, max_memory_size=max_memory_size,
+                  allowed_content_types=allowed_content_types,
+                  processors=processors)
+    try:
+        async for chunk in resp.aiter_bytes(chunk_size):
+            spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    return spool.finish()
+
+
+class AsyncFileOrURLMixin(object):
+    """
+    Adds aclean()/ato_python() to FileOrURLField. aclean() awaits the
+    download and then runs the regular clean(), which uses its result instead
+    of fetching the URL again.
+    """
+    async def adownload(self, url):
+        if (self.get_cache() is not None or
+                self.get_rate_limiter() is not None):
+            # caches and rate limiters are synchronous, use a worker thread
+            return await sync_to_async(
+                self.download, thread_sensitive=False)(url)
+        with timed(fetch_finished, self.__class__, field=self,
+                   url=url) as timer:
+            try:
+                result = await adownload(
+                    url, max_size=self.max_size,
+                    max_memory_size=self.max_memory_size,
+                    client=self.async_client, timeout=self.timeout,
+                    allowed_content_types=self.allowed_content_types,
+                    probe=self.probe, processors=self.processors)
+            except FetchError as e:
+                raise self.fetch_error(e)
+            timer.bytes = result.size
+            return result
+
+    async def aprefetch(self, value):
+        url = self.prefetch_url(value)
+        if url is None:
+            return
+        try:
+            self._prefetched[url] = await self.adownload(url)
+        except ValidationError as e:
+            self._prefetched[url] = e
+
+    async def ato_python(self, value):
+        if (self.to == 'file' and not self.lazy and
+                value not in self.empty_values and isinstance(value, str)):
+            return await self.adownload(value)
+        return self.to_python(value)
+
+    async def aclean(self, value):
+        await self.aprefetch(value)
+        return self.clean(value)
+
+
+class AsyncFormMixin(object):
+    """
+    Form mixin adding ais_valid(), which downloads the URLs of all the form's
+    FileOrURLFields concurrently before validating the form.
+    """
+    async def aprefetch(self):
+        await asyncio.gather(*[
+            field.aprefetch(self[name].data)
+            for name, field in self.fields.items()
+            if hasattr(field, 'aprefetch') and not field.disabled])
+
+    async def ais_valid(self):
+        if self.is_bound:
+            await self.aprefetch()
+        return await sync_to_async(self.is_valid)()
@@ -0,0 +1,353 @@
+"""
+Optional cache for files downloaded by FileOrURLField(to='file').
+
+Entries are indexed by URL and bodies are stored by the sha256 of their
+content, so URLs serving the same bytes share storage. Freshness follows the
+Cache-Control/Expires headers of the response and stale entries are
+revalidated with conditional requests using their ETag/Last-Modified.
+"""
+from io import BytesIO
+import hashlib
+import json
+import os
+import posixpath
+import re
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.utils.http import parse_http_date_safe
+from django.utils.module_loading import import_string
+from django.core.signals import setting_changed
+
+from .fetch import (
+    FetchTooLarge, FetchContentTypeError, content_type_allowed, limited,
+    open_url, probe_url, read_response, DEFAULT_CHUNK_SIZE)
+from .processors import process
+
+
+__all__ = ['DownloadCache', 'DjangoDownloadCache', 'DiskDownloadCache',
+           'get_download_cache']
+
+_cache_control_re = re.compile(r'([\w-]+)\s*(?:=\s*"?([^",]*)"?)?')
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def _hash(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def response_meta(headers, now=None):
+    """
+    Returns the cache metadata for a response with the given headers, or None
+    if it shouldn't be cached. The caches are shared by every user, so
+    `private` responses and those varying on unknown headers aren't cached.
+    """
+    if now is None:
+        now = time.time()
+    directives = dict(
+        (k.lower(), v) for k, v in
+        _cache_control_re.findall(headers.get('cache-control', '')))
+    if 'no-store' in directives or 'private' in directives:
+        return None
+    if '*' in [v.strip() for v in headers.get('vary', '').split(',')]:
+        return None
+    expires = None
+    if 'no-cache' in directives:
+        expires = 0
+    elif 'max-age' in directives:
+        try:
+            age = int(headers.get('age', 0))
+            expires = now + int(directives['max-age']) - age
+        except ValueError:
+            expires = 0
+    elif 'expires' in headers:
+        expires = parse_http_date_safe(headers['expires']) or 0
+    meta = {
+        'etag': headers.get('etag'),
+        'last_modified': headers.get('last-modified'),
+        'expires': expires,
+    }
+    if not (meta['etag'] or meta['last_modified'] or
+            (expires and expires > now)):
+        # can be neither reused nor revalidated
+        return None
+    return meta
+
+
+class DownloadCache(object):
+    """
+    Base class for download caches. Subclasses store metadata dicts by URL
+    and bodies by digest by implementing get_meta, set_meta, delete_meta,
+    open_body and store_body.
+    """
+    def __init__(self, max_entry_size=None):
+        self.max_entry_size = max_entry_size
+
+    def get_meta(self, url):
+        raise NotImplementedError
+
+    def set_meta(self, url, meta):
+        raise NotImplementedError
+
+    def delete_meta(self, url):
+        raise NotImplementedError
+
+    def open_body(self, digest):
+        """ Returns a file object for the body, or None if it's gone """
+        raise NotImplementedError
+
+    def store_body(self, content):
+        """ Stores the File `content` and returns its digest """
+        raise NotImplementedError
+
+    def cached_file(self, url, meta, body, processors=None):
+        cached = UploadedFile(body, posixpath.basename(url),
+                              meta['content_type'], meta['size'])
+        if processors:
+            process(cached, processors)
+        return cached
+
+    def download(self, url, max_size=None, max_memory_size=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, session=None, timeout=None,
+                 allowed_content_types=None, probe=False, rate_limiter=None,
+                 processors=None):
+        """
+        Same as fetch.download(), but going through the cache. Fresh hits
+        don't count against the budget of `rate_limiter`.
+        """
+        meta = self.get_meta(url)
+        body = None
+        if meta is not None:
+            if max_size is not None and meta['size'] > max_size:
+                raise FetchTooLarge(meta['size'])
+            if not content_type_allowed(meta['content_type'],
+                                        allowed_content_types):
+                raise FetchContentTypeError(meta['content_type'])
+            body = self.open_body(meta['digest'])
+            if body is None:
+                self.delete_meta(url)
+                meta = None
+            elif meta['expires'] and meta['expires'] > time.time():
+                return self.cached_file(url, meta, body, processors)
+
+        headers = {}
+        if meta is not None:
+            if meta['etag']:
+                headers['If-None-Match'] = meta['etag']
+            if meta['last_modified']:
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            with limited(rate_limiter, url):
+                if meta is None and probe:
+                    probe_url(url, session=session, timeout=timeout,
+                              max_size=max_size,
+                              allowed_content_types=allowed_content_types)
+                resp = open_url(url, session=session, timeout=timeout,
+                                headers=headers or None)
+                try:
+                    if resp.status_code == 304 and meta is not None:
+                        fresh = response_meta(resp.headers)
+                        if fresh is not None:
+                            meta.update(
+                                (k, v) for k, v in fresh.items() if v)
+                            meta['expires'] = fresh['expires']
+                            self.set_meta(url, meta)
+                        return self.cached_file(url, meta, body, processors)
+                    if body is not None:
+                        body.close()
+                    uploaded = read_response(
+                        resp, url, max_size=max_size,
+                        max_memory_size=max_memory_size,
+                        chunk_size=chunk_size,
+                        allowed_content_types=allowed_content_types,
+                        processors=processors)
+                    meta = response_meta(resp.headers)
+                finally:
+                    resp.close()
+        except Exception:
+            if body is not None:
+                body.close()
+            raise
+
+        if meta is not None and (self.max_entry_size is None or
+                                 uploaded.size <= self.max_entry_size):
+            meta['digest'] = self.store_body(uploaded)
+            meta['size'] = uploaded.size
+            meta['content_type'] = uploaded.content_type
+            self.set_meta(url, meta)
+            uploaded.seek(0)
+        return uploaded
+
+
+class DjangoDownloadCache(DownloadCache):
+    """
+    Stores downloads in one of the CACHES, which is then responsible for
+    eviction. Bodies bigger than `max_entry_size` (default 1MB) aren't cached.
+    """
+    def __init__(self, alias='default', max_entry_size=2 ** 20,
+                 key_prefix='xorformfields', timeout=None):
+        super(DjangoDownloadCache, self).__init__(max_entry_size)
+        self.alias = alias
+        self.key_prefix = key_prefix
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def _set(self, key, value):
+        if self.timeout is None:
+            self.cache.set(key, value)
+        else:
+            self.cache.set(key, value, self.timeout)
+
+    def _meta_key(self, url):
+        return '%s:url:%s' % (self.key_prefix, _hash(url))
+
+    def get_meta(self, url):
+        return self.cache.get(self._meta_key(url))
+
+    def set_meta(self, url, meta):
+        self._set(self._meta_key(url), meta)
+
+    def delete_meta(self, url):
+        self.cache.delete(self._meta_key(url))
+
+    def open_body(self, digest):
+        data = self.cache.get('%s:body:%s' % (self.key_prefix, digest))
+        if data is None:
+            return None
+        return BytesIO(data)
+
+    def store_body(self, content):
+        data = b''.join(content.chunks())
+        digest = hashlib.sha256(data).hexdigest()
+        self._set('%s:body:%s' % (self.key_prefix, digest), data)
+        return digest
+
+
+class DiskDownloadCache(DownloadCache):
+    """
+    Stores downloads in a local `directory`, evicting the least recently used
+    bodies once they add up to more than `max_size` bytes (default 100MB).
+    """
+    def __init__(self, directory, max_size=100 * 2 ** 20,
+                 max_entry_size=None):
+        if max_entry_size is None:
+            max_entry_size = max_size
+        super(DiskDownloadCache, self).__init__(max_entry_size)
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def _dir(self, name):
+        path = os.path.join(self.directory, name)
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+        return path
+
+    def _meta_path(self, url):
+        return os.path.join(self._dir('index'), _hash(url) + '.json')
+
+    def get_meta(self, url):
+        path = self._meta_path(url)
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set_meta(self, url, meta):
+        path = self._meta_path(url)
+        fd, tmp = tempfile.mkstemp(dir=self._dir('index'))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.rename(tmp, path)
+
+    def delete_meta(self, url):
+        try:
+            os.remove(self._meta_path(url))
+        except OSError:
+            pass
+
+    def open_body(self, digest):
+        path = os.path.join(self._dir('objects'), digest)
+        try:
+            body = open(path, 'rb')
+        except (IOError, OSError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return body
+
+    def store_body(self, content):
+        objects = self._dir('objects')
+        sha = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=objects)
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in content.chunks():
+                sha.update(chunk)
+                f.write(chunk)
+        digest = sha.hexdigest()
+        os.rename(tmp, os.path.join(objects, digest))
+        self.evict()
+        return digest
+
+    def evict(self):
+        """ Removes least recently used bodies until under max_size """
+        objects = self._dir('objects')
+        with self._lock:
+            entries = []
+            for name in os.listdir(objects):
+                try:
+                    stat = os.stat(os.path.join(objects, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(os.path.join(objects, name))
+                except OSError:
+                    continue
+                total -= size
+
+
+def get_download_cache():
+    """
+    Returns the cache configured by the XORFORMFIELDS_DOWNLOAD_CACHE setting,
+    or None. The setting is a dict with a BACKEND dotted path and OPTIONS
+    passed to it as keyword arguments.
+    """
+    global _default_cache
+    config = getattr(settings, 'XORFORMFIELDS_DOWNLOAD_CACHE', None)
+    if not config:
+        return None
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                backend = import_string(config['BACKEND'])
+                _default_cache = backend(**config.get('OPTIONS', {}))
+    return _default_cache
+
+
+def _reset_cache(setting, **kwargs):
+    global _default_cache
+    if setting == 'XORFORMFIELDS_DOWNLOAD_CACHE':
+        _default_cache = None
+
+setting_changed.connect(_reset_cache)
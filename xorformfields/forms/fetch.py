@@ -0,0 +1,336 @@
+"""
+Helpers used by FileOrURLField to download remote files.
+"""
+from contextlib import contextmanager
+import posixpath
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
+
+from .files import SpooledUploadedFile, DEFAULT_CONTENT_TYPE
+from .processors import Pipeline
+
+
+__all__ = ['FetchError', 'FetchTooLarge', 'FetchContentTypeError',
+           'FetchRateLimited', 'FetchAddressBlocked', 'Spool',
+           'download', 'open_url', 'probe_url', 'read_response',
+           'check_headers', 'content_type_allowed', 'get_session',
+           'set_session', 'build_session', 'get_http_options']
+
+DEFAULT_CHUNK_SIZE = 64 * 2 ** 10
+
+# Overridden key by key with the XORFORMFIELDS_HTTP setting
+DEFAULT_HTTP_OPTIONS = {
+    'POOL_CONNECTIONS': 10,
+    'POOL_MAXSIZE': 10,
+    'TIMEOUT': (3.05, 30),
+    'RETRIES': 2,
+    'BACKOFF_FACTOR': 0.3,
+    'RETRY_STATUSES': (502, 503, 504),
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class FetchError(Exception):
+    """ Raised when a remote file can't be fetched """
+
+
+class FetchTooLarge(FetchError):
+    """ Raised when a remote file is bigger than the allowed max_size """
+
+
+class FetchContentTypeError(FetchError):
+    """ Raised when a remote file's content type isn't allowed """
+
+
+class FetchRateLimited(FetchError):
+    """ Raised when a host has no fetch budget left """
+
+
+class FetchAddressBlocked(FetchError):
+    """ Raised when a host resolves to an address that isn't allowed """
+
+
+def content_type_allowed(content_type, allowed_content_types):
+    """
+    Returns whether `content_type` matches one of `allowed_content_types`,
+    which may contain wildcards such as 'image/*'. None allows everything.
+    """
+    if allowed_content_types is None:
+        return True
+    content_type = (content_type or DEFAULT_CONTENT_TYPE).split(';')[0]
+    content_type = content_type.strip().lower()
+    for pattern in allowed_content_types:
+        pattern = pattern.lower()
+        if pattern in (content_type, '*/*', '*'):
+            return True
+        if pattern.endswith('/*') and content_type.startswith(pattern[:-1]):
+            return True
+    return False
+
+
+class Spool(object):
+    """
+    Writes downloaded chunks to a SpooledUploadedFile, which moves them to
+    disk past `max_memory_size` bytes. Writing more than `max_size` bytes
+    raises FetchTooLarge, and FetchContentTypeError is raised after the first
+    chunk if the content type sniffed from it isn't allowed. Chunks are also
+    fed to `processors`, whose results are set as the file's `processed`.
+    """
+    def __init__(self, name, content_type, charset=None, max_size=None,
+                 max_memory_size=None, allowed_content_types=None,
+                 processors=None):
+        self.max_size = max_size
+        self.allowed_content_types = allowed_content_types
+        self.pipeline = None
+        if processors:
+            self.pipeline = Pipeline(processors)
+        self.file = SpooledUploadedFile(name, content_type, charset,
+                                        max_memory_size=max_memory_size)
+
+    def write(self, chunk):
+        if (self.max_size is not None and
+                self.file.size + len(chunk) > self.max_size):
+            raise FetchTooLarge(self.file.name)
+        first = not self.file.size
+        self.file.write(chunk)
+        if first and not content_type_allowed(self.file.content_type,
+                                              self.allowed_content_types):
+            raise FetchContentTypeError(self.file.content_type)
+        if self.pipeline is not None:
+            self.pipeline.update(chunk)
+
+    def finish(self):
+        """ Returns the spooled data as an UploadedFile """
+        self.file.seek(0)
+        if self.pipeline is not None:
+            self.file.processed = self.pipeline.results()
+        return self.file
+
+    def close(self):
+        self.file.close()
+
+
+def get_http_options():
+    options = dict(DEFAULT_HTTP_OPTIONS)
+    options.update(getattr(settings, 'XORFORMFIELDS_HTTP', {}))
+    return options
+
+
+def build_session(pool_connections=None, pool_maxsize=None, retries=None,
+                  backoff_factor=None, retry_statuses=None, resolver=None):
+    """
+    Builds a requests.Session with a connection pool and retry policy. Any
+    argument left as None is taken from the XORFORMFIELDS_HTTP setting.
+    Connections go to the addresses checked by `resolver`, which defaults to
+    the XORFORMFIELDS_RESOLVER setting (False connects anywhere).
+    """
+    # requests is only imported once something is actually fetched
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    from .resolver import get_resolver, pinned_adapter
+
+    options = get_http_options()
+    retry = Retry(
+        total=(options['RETRIES'] if retries is None else retries),
+        backoff_factor=(options['BACKOFF_FACTOR'] if backoff_factor is None
+                        else backoff_factor),
+        status_forcelist=(options['RETRY_STATUSES'] if retry_statuses is None
+                          else retry_statuses),
+        raise_on_status=False)
+    kwargs = dict(
+        pool_connections=(options['POOL_CONNECTIONS']
+                          if pool_connections is None else pool_connections),
+        pool_maxsize=(options['POOL_MAXSIZE'] if pool_maxsize is None
+                      else pool_maxsize),
+        max_retries=retry)
+    if resolver is None:
+        resolver = get_resolver()
+    if resolver:
+        adapter = pinned_adapter(resolver, **kwargs)
+    else:
+        adapter = HTTPAdapter(**kwargs)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """
+    Returns the process-wide session used for URL fetching, building it on
+    first use so connections are kept alive between fetches.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def set_session(session):
+    """
+    Replaces the process-wide session. Passing None closes the current one and
+    causes a new one to be built from settings on next use.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None and _session is not session:
+            _session.close()
+        _session = session
+
+
+def _reset_session(setting, **kwargs):
+    if setting in ('XORFORMFIELDS_HTTP', 'XORFORMFIELDS_RESOLVER'):
+        set_session(None)
+
+setting_changed.connect(_reset_session)
+
+
+@contextmanager
+def limited(rate_limiter, url):
+    """ rate_limiter.limit(url), or nothing if `rate_limiter` is None """
+    if rate_limiter is None:
+        yield
+    else:
+        with rate_limiter.limit(url):
+            yield
+
+
+def check_content_length(headers, max_size):
+    """
+    Raises FetchTooLarge if the response headers announce a body bigger than
+    `max_size`, before any of it is read.
+    """
+    if max_size is None:
+        return
+    try:
+        length = int(headers.get('content-length'))
+    except (TypeError, ValueError):
+        return
+    if length > max_size:
+        raise FetchTooLarge(length)
+
+
+def check_headers(headers, max_size=None, allowed_content_types=None):
+    """
+    Raises FetchTooLarge or FetchContentTypeError if the response headers
+    show the body shouldn't be downloaded.
+    """
+    check_content_length(headers, max_size)
+    content_type = headers.get('content-type')
+    if not content_type_allowed(content_type, allowed_content_types):
+        raise FetchContentTypeError(content_type)
+
+
+def open_url(url, session=None, timeout=None, headers=None):
+    """
+    Sends a streaming GET for `url` and returns the response once its headers
+    have arrived, raising FetchError for failed requests.
+    """
+    if session is None:
+        session = get_session()
+    if timeout is None:
+        timeout = get_http_options()['TIMEOUT']
+    try:
+        resp = session.get(url, stream=True, timeout=timeout,
+                           headers=headers)
+    except FetchError:
+        raise
+    except Exception:
+        raise FetchError(url)
+    if not (200 <= resp.status_code < 400):
+        resp.close()
+        raise FetchError(url)
+    return resp
+
+
+def probe_url(url, session=None, timeout=None, max_size=None,
+              allowed_content_types=None):
+    """
+    Sends a HEAD for `url` and checks its headers with check_headers(). The
+    probe is best effort: servers that fail it (some refuse HEAD, and signed
+    URLs are often only valid for GET) are left to the GET to check.
+    """
+    if session is None:
+        session = get_session()
+    if timeout is None:
+        timeout = get_http_options()['TIMEOUT']
+    try:
+        resp = session.head(url, timeout=timeout, allow_redirects=True)
+    except Exception:
+        return
+    try:
+        if 200 <= resp.status_code < 300:
+            check_headers(resp.headers, max_size, allowed_content_types)
+    finally:
+        resp.close()
+
+
+def read_response(resp, url, max_size=None, max_memory_size=None,
+                  chunk_size=DEFAULT_CHUNK_SIZE, allowed_content_types=None,
+                  processors=None):
+    """ Spools the body of a streaming response into an UploadedFile """
+    check_headers(resp.headers, max_size, allowed_content_types)
+    spool = Spool(posixpath.basename(url), resp.headers.get('content-type'),
+                  max_size=max_size, max_memory_size=max_memory_size,
+                  allowed_content_types=allowed_content_types,
+                  processors=processors)
+    try:
+        for chunk in resp.iter_content(chunk_size):
+            spool.write(chunk)
+    except (FetchError, ValidationError):
+        spool.close()
+        raise
+    except Exception:
+        spool.close()
+        raise FetchError(url)
+    return spool.finish()
+
+
+def download(url, max_size=None, max_memory_size=None,
+             chunk_size=DEFAULT_CHUNK_SIZE, session=None, timeout=None,
+             cache=None, allowed_content_types=None, probe=False,
+             rate_limiter=None, processors=None):
+    """
+    Streams `url` into an UploadedFile without ever holding more than
+    `max_memory_size` bytes of it in memory. Uses the process-wide session
+    unless one is given, and goes through `cache` (a DownloadCache) if given.
+
+    The size and content type announced by the response headers are checked
+    against `max_size` and `allowed_content_types` before reading the body.
+    With `probe`, they are first checked with a HEAD request, so a rejected
+    file doesn't even get its GET sent.
+
+    Requests are made under the per-host budget of `rate_limiter` (a
+    ratelimit.RateLimiter) if given. The body is fed to `processors` as it
+    arrives (see processors.py), they run over cached files in one pass.
+    """
+    if cache is not None:
+        return cache.download(url, max_size=max_size,
+                              max_memory_size=max_memory_size,
+                              chunk_size=chunk_size, session=session,
+                              timeout=timeout,
+                              allowed_content_types=allowed_content_types,
+                              probe=probe, rate_limiter=rate_limiter,
+                              processors=processors)
+    with limited(rate_limiter, url):
+        if probe:
+            probe_url(url, session=session, timeout=timeout,
+                      max_size=max_size,
+                      allowed_content_types=allowed_content_types)
+        resp = open_url(url, session=session, timeout=timeout)
+        try:
+            return read_response(resp, url, max_size=max_size,
+                                 max_memory_size=max_memory_size,
+                                 chunk_size=chunk_size,
+                                 allowed_content_types=allowed_content_types,
+                                 processors=processors)
+        finally:
+            resp.close()
@@ -1,28 +1,54 @@
-try:
-    from io import StringIO
-except ImportError:
-    from StringIO import StringIO
-try:
-    unicode
-except NameError:
-    unicode = str
-import posixpath
-import os
+from collections import namedtuple
+import copy
 
 from django.core.exceptions import ValidationError
-from django.forms.fields import MultiValueField, FileField, URLField
+from django.forms.fields import (
+    ChoiceField, Field, MultiValueField, FileField, URLField)
 from django.forms.utils import ErrorList
 from django.core.validators import EMPTY_VALUES
-from django.core.files.uploadedfile import UploadedFile, InMemoryUploadedFile
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.forms.widgets import FileInput
 
-import requests
+from ..signals import clean_finished, fetch_finished, timed
+from .cache import get_download_cache
+from .files import LazyRemoteFile
+from .fetch import (
+    FetchError, FetchTooLarge, FetchContentTypeError, FetchRateLimited,
+    FetchAddressBlocked, content_type_allowed, download)
+from .ratelimit import get_rate_limiter
+from .processors import process
+from .storage import (
+    save, defer_save, get_upload_executor, storage_url, unsigned_storage,
+    PendingURL, StoredURL)
+from .widgets import (
+    MutuallyExclusiveRadioWidget, FileOrURLWidget, KeyedExclusiveRadioWidget,
+    copy_widget)
 
-from .widgets import MutuallyExclusiveRadioWidget, FileOrURLWidget
+from .aio import AsyncFileOrURLMixin
 
 
-__all__ = ['MutuallyExclusiveValueField', 'FileOrURLField']
+__all__ = ['MutuallyExclusiveValueField', 'FileOrURLField',
+           'KeyedExclusiveValueField', 'ExclusiveChoice']
+
+ExclusiveChoice = namedtuple('ExclusiveChoice', 'key value')
+
+# fields copied by these are safe to copy with copy_field()
+_SHALLOW_DEEPCOPIES = (Field.__deepcopy__, ChoiceField.__deepcopy__)
+
+
+def copy_field(field, memo):
+    """
+    Copies the subfield `field` for a new form like deepcopy() does, but
+    shares its choices, validators and error messages. Fields with their own
+    __deepcopy__ (eg: ModelChoiceField, which copies its queryset) are
+    deep-copied.
+    """
+    if type(field).__deepcopy__ not in _SHALLOW_DEEPCOPIES:
+        return copy.deepcopy(field, memo)
+    result = copy.copy(field)
+    memo[id(field)] = result
+    result.widget = copy_widget(field.widget, memo)
+    return result
 
 
 class MutuallyExclusiveValueField(MultiValueField):
@@ -30,12 +56,31 @@ class MutuallyExclusiveValueField(MultiValueField):
     empty_values = EMPTY_VALUES
 
     def __init__(self, fields=(), *args, **kwargs):
+        """
+        With `short_circuit`, clean() finds the one non-empty value first,
+        raising too_many_values_error before validating anything if there
+        are several, and only cleans the subfield it belongs to. Subfields
+        that clean empty input to a non-empty value (eg: BooleanField) are
+        then not taken into account.
+        """
+        self.short_circuit = kwargs.pop('short_circuit', False)
         if 'widget' not in kwargs:
             kwargs['widget'] = MutuallyExclusiveRadioWidget(widgets=[
                 field.widget for field in fields])
         super(MutuallyExclusiveValueField, self).__init__(
             fields, *args, **kwargs)
 
+    def __deepcopy__(self, memo):
+        # forms copy their fields on every instantiation, only copy what
+        # they can change
+        result = copy.copy(self)
+        memo[id(self)] = result
+        result.widget = copy.deepcopy(self.widget, memo)
+        result.error_messages = self.error_messages.copy()
+        result.validators = self.validators[:]
+        result.fields = tuple(copy_field(f, memo) for f in self.fields)
+        return result
+
     def clean(self, value):
         """
         Validates every value in the given list. A value is validated against
@@ -49,8 +94,10 @@ class MutuallyExclusiveValueField(MultiValueField):
                 fields=(forms.TypedChoiceField(choices=[(1,1), (2,2)], coerce=int),
                         forms.IntegerField()))
         """
-        clean_data = []
-        errors = ErrorList()
+        with timed(clean_finished, self.__class__, field=self):
+            return self._clean(value)
+
+    def _clean(self, value):
         if not value or isinstance(value, (list, tuple)):
             if not value or not [
                     v for v in value if v not in self.empty_values]:
@@ -62,6 +109,20 @@ class MutuallyExclusiveValueField(MultiValueField):
         else:
             raise ValidationError(
                 self.error_messages['invalid'], code='invalid')
+        if self.short_circuit:
+            clean_data = self.clean_nonempty(value)
+        else:
+            clean_data = self.clean_all(value)
+
+        out = self.compress(clean_data)
+        self.validate(out)
+        self.run_validators(out)
+        return out
+
+    def clean_all(self, value):
+        """ Cleans every value in `value` with its subfield """
+        clean_data = []
+        errors = ErrorList()
         for i, field in enumerate(self.fields):
             try:
                 field_value = value[i]
@@ -76,11 +137,74 @@ class MutuallyExclusiveValueField(MultiValueField):
                 errors.extend(e.messages)
         if errors:
             raise ValidationError(errors)
+        return clean_data
 
-        out = self.compress(clean_data)
-        self.validate(out)
-        self.run_validators(out)
-        return out
+    def clean_nonempty(self, value):
+        """
+        Cleans only the non-empty value in `value`, the others are left as
+        None.
+        """
+        nonempty = self.nonempty_indexes(value)
+        if len(nonempty) > 1:
+            raise ValidationError(self.too_many_values_error)
+        clean_data = [None] * len(self.fields)
+        for i in nonempty:
+            try:
+                clean_data[i] = self.fields[i].clean(value[i])
+            except ValidationError as e:
+                raise ValidationError(e.messages)
+        return clean_data
+
+    def nonempty_indexes(self, value):
+        """ Returns the indexes of the subfields `value` has a value for """
+        return [i for i, v in enumerate(value[:len(self.fields)])
+                if v not in self.empty_values]
+
+    def clean_many(self, rows):
+        """
+        Validates a batch of values, eg: the rows of an import, without
+        building a form per row. Returns a list with a (value, error) pair
+        for each row, where error is None or the ValidationError the row
+        failed with.
+
+        Exclusivity and required checks run over the whole batch first, then
+        only the one filled-in subfield of the remaining rows is cleaned, the
+        way clean() does with `short_circuit`.
+        """
+        checked = []
+        for value in rows:
+            error = None
+            nonempty = []
+            if value and not isinstance(value, (list, tuple)):
+                error = ValidationError(
+                    self.error_messages['invalid'], code='invalid')
+            else:
+                nonempty = self.nonempty_indexes(value or ())
+                if len(nonempty) > 1:
+                    error = ValidationError(self.too_many_values_error)
+                elif not nonempty and self.required:
+                    error = ValidationError(
+                        self.error_messages['required'], code='required')
+            checked.append((error, nonempty[0] if nonempty else None, value))
+
+        results = []
+        for error, i, value in checked:
+            clean_data = [None] * len(self.fields)
+            try:
+                # each row is timed (and sent to clean_finished) like clean()
+                with timed(clean_finished, self.__class__, field=self):
+                    if error is not None:
+                        raise error
+                    if i is not None:
+                        clean_data[i] = self.fields[i].clean(value[i])
+                    out = self.compress(clean_data)
+                    self.validate(out)
+                    self.run_validators(out)
+            except ValidationError as e:
+                results.append((None, e))
+            else:
+                results.append((out, None))
+        return results
 
     def compress(self, data_list):
         """
@@ -102,9 +226,93 @@ class MutuallyExclusiveValueField(MultiValueField):
         return non_empty_list[0]
 
 
-class FileOrURLField(MutuallyExclusiveValueField):
+class KeyedExclusiveValueField(MutuallyExclusiveValueField):
+    """
+    Variant of MutuallyExclusiveValueField whose alternatives are named:
+
+        KeyedExclusiveValueField(fields=[
+            ('isbn', forms.CharField(max_length=13)),
+            ('doi', forms.CharField()),
+            ('url', forms.URLField()),
+        ])
+
+    The submitted radio selects which subfield is read and validated, the
+    others are ignored, and the cleaned value is an ExclusiveChoice of the
+    key and value of the selected alternative.
+    """
+    def __init__(self, fields=(), *args, **kwargs):
+        if isinstance(fields, dict):
+            fields = fields.items()
+        fields = list(fields)
+        self.keys = [key for key, _ in fields]
+        self.key_indexes = dict((key, i) for i, key in enumerate(self.keys))
+        if 'widget' not in kwargs:
+            kwargs['widget'] = KeyedExclusiveRadioWidget(widgets=[
+                (key, field.widget) for key, field in fields])
+        super(KeyedExclusiveValueField, self).__init__(
+            [field for _, field in fields], *args, **kwargs)
+
+    def _clean(self, value):
+        if isinstance(value, ExclusiveChoice):
+            value = {value.key: value.value}
+        elif isinstance(value, (list, tuple)):
+            value = dict(zip(self.keys, value))
+        elif value in self.empty_values:
+            value = {}
+        elif not isinstance(value, dict):
+            raise ValidationError(
+                self.error_messages['invalid'], code='invalid')
+        nonempty = [(key, v) for key, v in value.items()
+                    if v not in self.empty_values]
+        if not nonempty:
+            if self.required:
+                raise ValidationError(
+                    self.error_messages['required'], code='required')
+            return None
+        elif len(nonempty) > 1:
+            raise ValidationError(self.too_many_values_error)
+        key, field_value = nonempty[0]
+        if key not in self.key_indexes:
+            raise ValidationError(
+                self.error_messages['invalid'], code='invalid')
+        try:
+            out = ExclusiveChoice(
+                key, self.fields[self.key_indexes[key]].clean(field_value))
+        except ValidationError as e:
+            raise ValidationError(e.messages)
+        self.validate(out)
+        self.run_validators(out)
+        return out
+
+    def clean_many(self, rows):
+        # _clean already checks exclusivity before running any subfield
+        results = []
+        for value in rows:
+            try:
+                with timed(clean_finished, self.__class__, field=self):
+                    out = self._clean(value)
+            except ValidationError as e:
+                results.append((None, e))
+            else:
+                results.append((out, None))
+        return results
+
+    def has_changed(self, initial, data):
+        return super(KeyedExclusiveValueField, self).has_changed(
+            self.widget.decompress(initial), self.widget.decompress(data))
+
+
+class FileOrURLField(AsyncFileOrURLMixin, MutuallyExclusiveValueField):
     widget = FileOrURLWidget
     url_fetch_error = 'Failed to fetch URL specified'
+    url_too_large_error = 'The file at the URL specified is too large'
+    url_content_type_error = ('The file at the URL specified is not of an '
+                              'allowed type')
+    file_too_large_error = 'The file is too large'
+    file_content_type_error = 'The file is not of an allowed type'
+    url_rate_limited_error = ('Too many URLs submitted for this site, try '
+                              'again later')
+    url_address_error = 'The URL specified points to a forbidden address'
 
     def __init__(self, to=None, *args, **kwargs):
         """
@@ -114,10 +322,60 @@ class FileOrURLField(MutuallyExclusiveValueField):
             'file': if an url is submited, download it into an inmemory object
             'url': uploads the file to default storage and returns the URL
         The`upload_to` param must be set when to='url'
-        if using AWS, set no_aws_qs to disable querystring auth
+        if using AWS, set no_aws_qs to disable querystring auth (URLs are
+        then generated by a copy of the storage, the storage itself isn't
+        changed). With `url_cache_ttl`, the URL generated for a path is
+        reused for that many seconds.
+        When to='file', downloads are streamed: `max_size` caps the number of
+        bytes accepted and `max_memory_size` (defaults to
+        FILE_UPLOAD_MAX_MEMORY_SIZE) is the point past which the download is
+        spooled to a temporary file on disk.
+        `allowed_content_types` restricts the types of downloaded files
+        (wildcards like 'image/*' are accepted). Both limits are checked
+        against the response headers before the body is read and, with
+        `probe`, against a HEAD request before the GET is sent. Uploaded
+        files are held to the same limits, which are also rendered on the
+        file input for mutually_exclusive_widget.js to check before sending.
+        With `lazy`, clean() returns a LazyRemoteFile which only downloads
+        the URL when its content is first accessed.
+        `processors` is a list of ChunkProcessors run on the bytes of the
+        file as they are downloaded or saved to storage. Their results are
+        set as the `processed` dict of the returned file (or StoredURL).
+        Downloads go through a pooled, process-wide requests.Session
+        configured by the XORFORMFIELDS_HTTP setting; pass `session` and/or
+        `timeout` to override them for this field (and `async_client`, an
+        httpx.AsyncClient, for aclean()/ato_python()).
+        `cache` is a DownloadCache to reuse earlier downloads of the same
+        URL, it defaults to the XORFORMFIELDS_DOWNLOAD_CACHE setting and
+        False disables caching for this field.
+        `rate_limiter` is a RateLimiter capping the fetches per host, it
+        defaults to the XORFORMFIELDS_RATE_LIMIT setting and False disables
+        rate limiting for this field.
+        When to='url', uploads are streamed to `storage` (defaults to
+        default_storage). With `hash_names`, they are named after the sha256
+        of their content and identical files are only stored once.
+        With `deferred`, the URL is returned as a PendingURL right away and
+        the save runs on `executor` (defaults to get_upload_executor()).
         """
         self.to = to
+        self.max_size = kwargs.pop('max_size', None)
+        self.max_memory_size = kwargs.pop('max_memory_size', None)
+        self.allowed_content_types = kwargs.pop('allowed_content_types', None)
+        self.probe = kwargs.pop('probe', False)
+        self.lazy = kwargs.pop('lazy', False)
+        self.processors = kwargs.pop('processors', None)
+        self.session = kwargs.pop('session', None)
+        self.timeout = kwargs.pop('timeout', None)
+        self.async_client = kwargs.pop('async_client', None)
+        self.cache = kwargs.pop('cache', None)
+        self.rate_limiter = kwargs.pop('rate_limiter', None)
+        self._prefetched = {}
         self.no_aws_qs = kwargs.pop('no_aws_qs', False)
+        self.url_cache_ttl = kwargs.pop('url_cache_ttl', None)
+        self.storage = kwargs.pop('storage', None)
+        self.hash_names = kwargs.pop('hash_names', False)
+        self.deferred = kwargs.pop('deferred', False)
+        self.executor = kwargs.pop('executor', None)
         if 'upload_to' in kwargs:
             self.upload_to = kwargs.pop('upload_to')
         elif self.to == 'url':
@@ -125,6 +383,25 @@ class FileOrURLField(MutuallyExclusiveValueField):
                                'must be set')
         fields = (FileField(), URLField())
         super(FileOrURLField, self).__init__(fields, *args, **kwargs)
+        file_widget = getattr(self.widget, 'widgets', [None])[0]
+        if isinstance(file_widget, FileInput):
+            file_widget.attrs.update(self.file_widget_attrs())
+
+    def file_widget_attrs(self):
+        """ Attributes of the file input describing the upload limits """
+        attrs = {}
+        if self.max_size is not None:
+            attrs['data-max-size'] = self.max_size
+            attrs['data-max-size-error'] = self.file_too_large_error
+        if self.allowed_content_types is not None:
+            attrs['accept'] = ','.join(self.allowed_content_types)
+            attrs['data-content-type-error'] = self.file_content_type_error
+        return attrs
+
+    def __deepcopy__(self, memo):
+        result = super(FileOrURLField, self).__deepcopy__(memo)
+        result._prefetched = {}
+        return result
 
     def compress(self, data_list):
         """ override just cause we want a to_python """
@@ -133,32 +410,127 @@ class FileOrURLField(MutuallyExclusiveValueField):
 
     def to_python(self, value):
         value = super(FileOrURLField, self).to_python(value)
+        if isinstance(value, UploadedFile):
+            self.check_file(value)
+            if self.processors and self.to != 'url':
+                process(value, self.processors)
 
         if self.to == None:
             return value
         elif self.to == 'file' and not isinstance(value, UploadedFile):
-            try:
-                resp = requests.get(value)
-            except:
-                raise ValidationError(self.url_fetch_error)
-            if not (200 <= resp.status_code < 400):
-                raise ValidationError(self.url_fetch_error)
-            io = StringIO(unicode(resp.content))
-            io.seek(0)
-            io.seek(os.SEEK_END)
-            size = io.tell()
-            io.seek(0)
-            return InMemoryUploadedFile(
-                io, None,
-                posixpath.basename(value),
-                resp.headers['content-type'],
-                size, None)
+            if value in self.empty_values:
+                return value
+            if self.lazy:
+                return LazyRemoteFile(value, self.fetch)
+            return self.fetch(value)
         elif self.to == 'url' and isinstance(value, UploadedFile):
-            path = default_storage.save(
-                posixpath.join(self.upload_to, value.name),
-                ContentFile(value.read()))
+            storage = self.get_storage()
+            if self.deferred:
+                path, future = defer_save(
+                    storage, self.upload_to, value,
+                    self.executor or get_upload_executor(),
+                    hash_names=self.hash_names, processors=self.processors)
+            else:
+                path = save(storage, self.upload_to, value,
+                            hash_names=self.hash_names,
+                            processors=self.processors)
             if self.no_aws_qs:
-                default_storage.querystring_auth = False
-            return default_storage.url(path)
+                storage = unsigned_storage(storage)
+            url = storage_url(storage, path, self.url_cache_ttl)
+            processed = getattr(value, 'processed', None)
+            if self.deferred:
+                return PendingURL(url, future, processed)
+            return StoredURL(url, processed)
 
         return value
+
+    def check_file(self, value):
+        """ Validates an uploaded file against max_size and content types """
+        if self.max_size is not None and value.size > self.max_size:
+            raise ValidationError(self.file_too_large_error)
+        if not content_type_allowed(value.content_type,
+                                    self.allowed_content_types):
+            raise ValidationError(self.file_content_type_error)
+
+    def get_storage(self):
+        if self.storage is None:
+            from django.core.files.storage import default_storage
+            return default_storage
+        return self.storage
+
+    def fetch_error(self, exc):
+        """ Returns the ValidationError to raise for a FetchError """
+        if isinstance(exc, FetchTooLarge):
+            return ValidationError(self.url_too_large_error)
+        if isinstance(exc, FetchContentTypeError):
+            return ValidationError(self.url_content_type_error)
+        if isinstance(exc, FetchRateLimited):
+            return ValidationError(self.url_rate_limited_error)
+        if isinstance(exc, FetchAddressBlocked):
+            return ValidationError(self.url_address_error)
+        return ValidationError(self.url_fetch_error)
+
+    def get_cache(self):
+        if self.cache is None:
+            return get_download_cache()
+        return self.cache or None
+
+    def get_rate_limiter(self):
+        if self.rate_limiter is None:
+            return get_rate_limiter()
+        return self.rate_limiter or None
+
+    def download(self, url):
+        with timed(fetch_finished, self.__class__, field=self,
+                   url=url) as timer:
+            try:
+                result = download(url, max_size=self.max_size,
+                                  max_memory_size=self.max_memory_size,
+                                  session=self.session, timeout=self.timeout,
+                                  cache=self.get_cache(),
+                                  allowed_content_types=(
+                                      self.allowed_content_types),
+                                  probe=self.probe,
+                                  rate_limiter=self.get_rate_limiter(),
+                                  processors=self.processors)
+            except FetchError as e:
+                raise self.fetch_error(e)
+            timer.bytes = result.size
+            return result
+
+    def fetch(self, url):
+        """
+        Returns `url` as an UploadedFile, using the result of an earlier
+        prefetch if there is one.
+        """
+        try:
+            result = self._prefetched.pop(url)
+        except KeyError:
+            return self.download(url)
+        if isinstance(result, ValidationError):
+            raise result
+        return result
+
+    def prefetch(self, url):
+        """ Downloads `url` now for a later clean() to use """
+        try:
+            self._prefetched[url] = self.download(url)
+        except ValidationError as e:
+            self._prefetched[url] = e
+
+    def prefetch_url(self, value):
+        """
+        Returns the URL that clean() would download for the raw widget
+        `value`, or None if it wouldn't download anything.
+        """
+        if (self.to != 'file' or self.lazy or
+                not isinstance(value, (list, tuple))):
+            return None
+        if len(value) < 2 or value[1] in self.empty_values or [
+                v for v in value[:1] + value[2:]
+                if v not in self.empty_values]:
+            return None
+        try:
+            return self.fields[1].clean(value[1])
+        except ValidationError:
+            return None
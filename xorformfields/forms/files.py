@@ -0,0 +1,186 @@
+"""
+File objects returned by FileOrURLField.
+"""
+import mmap
+import posixpath
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+
+__all__ = ['SpooledUploadedFile', 'LazyRemoteFile', 'sniff_content_type']
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+# bytes sniff_content_type() needs to see every magic number
+SNIFF_SIZE = 16
+
+# (offset, magic bytes, content type)
+MAGIC_NUMBERS = (
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (8, b'WEBP', 'image/webp'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'ID3', 'audio/mpeg'),
+)
+
+
+def sniff_content_type(data):
+    """
+    Returns the content type identified by the magic number at the start of
+    `data`, or None.
+    """
+    for offset, magic, content_type in MAGIC_NUMBERS:
+        if data[offset:offset + len(magic)] == magic:
+            if magic == b'WEBP' and data[:4] != b'RIFF':
+                continue
+            return content_type
+    return None
+
+
+class SpooledUploadedFile(UploadedFile):
+    """
+    A byte-oriented UploadedFile backed by a tempfile.SpooledTemporaryFile.
+
+    It's filled with write(), which keeps an exact count of the bytes written
+    in `size` and sniffs the content type from the first SNIFF_SIZE bytes,
+    however they are split between writes (falling back to the
+    `content_type` it was created with, which stays available as
+    `declared_content_type`). Data stays in memory until `max_memory_size`
+    bytes (defaults to FILE_UPLOAD_MAX_MEMORY_SIZE) and then moves to disk.
+
+    Besides the usual file API, readinto() and getbuffer() give access to the
+    content without intermediate copies. `in_memory` and getbuffer() rely on
+    the private `_rolled` and `_file` of SpooledTemporaryFile, should they
+    ever go away the content is treated as being on disk.
+    """
+    def __init__(self, name=None, content_type=None, charset=None,
+                 max_memory_size=None, content_type_extra=None):
+        if max_memory_size is None:
+            max_memory_size = settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        file = tempfile.SpooledTemporaryFile(
+            max_size=max_memory_size, suffix='.upload',
+            dir=settings.FILE_UPLOAD_TEMP_DIR)
+        super(SpooledUploadedFile, self).__init__(
+            file, name, content_type or DEFAULT_CONTENT_TYPE, 0, charset,
+            content_type_extra)
+        self.declared_content_type = content_type
+        self._header = b''
+
+    @property
+    def in_memory(self):
+        return not getattr(self.file, '_rolled', True)
+
+    def write(self, data):
+        if len(self._header) < SNIFF_SIZE:
+            self._header += bytes(data[:SNIFF_SIZE - len(self._header)])
+            sniffed = sniff_content_type(self._header)
+            if sniffed is not None:
+                self.content_type = sniffed
+        self.file.write(data)
+        self.size += len(data)
+
+    def readinto(self, buffer):
+        if hasattr(self.file, 'readinto'):
+            return self.file.readinto(buffer)
+        # SpooledTemporaryFile only has readinto() since Python 3.11, the
+        # BytesIO or file it wraps always had it
+        return self.file._file.readinto(buffer)
+
+    def getbuffer(self):
+        """
+        Returns a read-only memoryview of the whole content, over the
+        in-memory buffer or a memory map of the file on disk.
+        """
+        if self.in_memory:
+            return self.file._file.getbuffer().toreadonly()
+        if not self.size:
+            return memoryview(b'')
+        self.file.flush()
+        return memoryview(mmap.mmap(
+            self.file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def open(self, mode=None):
+        self.file.seek(0)
+        return self
+
+
+class LazyRemoteFile(UploadedFile):
+    """
+    Stands in for the file at `url` until its content is needed. The first
+    access to the data, `size`, `content_type` or `charset` calls `loader`
+    with the URL, and the UploadedFile it returns is then used for
+    everything. Errors raised by `loader` propagate to that first access.
+    """
+    def __init__(self, url, loader):
+        self.url = url
+        self.name = posixpath.basename(url)
+        self.content_type_extra = None
+        self._loader = loader
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """ Whether the file was downloaded already """
+        return self._loaded is not None
+
+    def load(self):
+        """ Downloads the file if needed and returns the UploadedFile """
+        if self._loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    self._loaded = self._loader(self.url)
+        return self._loaded
+
+    @property
+    def file(self):
+        return self.load().file
+
+    @property
+    def size(self):
+        return self.load().size
+
+    @property
+    def content_type(self):
+        return self.load().content_type
+
+    @property
+    def charset(self):
+        return self.load().charset
+
+    def __getattr__(self, name):
+        # eg: getbuffer() or readinto() of a SpooledUploadedFile
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.url)
+
+    def chunks(self, chunk_size=None):
+        return self.load().chunks(chunk_size)
+
+    def multiple_chunks(self, chunk_size=None):
+        return self.load().multiple_chunks(chunk_size)
+
+    def open(self, mode=None):
+        self.load().open(mode)
+        return self
+
+    @property
+    def closed(self):
+        return self._loaded is None or self._loaded.closed
+
+    def close(self):
+        if self._loaded is not None:
+            self._loaded.close()
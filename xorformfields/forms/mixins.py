@@ -0,0 +1,60 @@
+from django.conf import settings
+
+
+__all__ = ['PrefetchURLsMixin', 'PrefetchURLsFormSetMixin', 'prefetch_urls']
+
+DEFAULT_PREFETCH_WORKERS = 8
+
+
+def prefetch_urls(forms, max_workers=None):
+    """
+    Downloads the URLs submitted to every FileOrURLField of the given bound
+    forms in parallel, on a pool of at most `max_workers` threads (defaults
+    to the XORFORMFIELDS_PREFETCH_WORKERS setting). The fields' clean() then
+    uses the downloaded files instead of fetching them one after another.
+    """
+    jobs = []
+    for form in forms:
+        if not form.is_bound:
+            continue
+        for name, field in form.fields.items():
+            if not hasattr(field, 'prefetch_url') or field.disabled:
+                continue
+            url = field.prefetch_url(form[name].data)
+            if url is not None and url not in field._prefetched:
+                jobs.append((field, url))
+    if len(jobs) < 2:
+        # nothing to gain from a pool, let clean() fetch it
+        return
+    if max_workers is None:
+        max_workers = getattr(settings, 'XORFORMFIELDS_PREFETCH_WORKERS',
+                              DEFAULT_PREFETCH_WORKERS)
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+        for _ in pool.map(lambda job: job[0].prefetch(job[1]), jobs):
+            pass
+
+
+class PrefetchURLsMixin(object):
+    """
+    Form mixin that downloads all URL-valued FileOrURLFields in parallel
+    before the form is cleaned.
+    """
+    prefetch_max_workers = None
+
+    def full_clean(self):
+        prefetch_urls([self], self.prefetch_max_workers)
+        super(PrefetchURLsMixin, self).full_clean()
+
+
+class PrefetchURLsFormSetMixin(object):
+    """
+    Formset mixin that downloads the URL-valued FileOrURLFields of every form
+    in the formset in parallel before the forms are cleaned.
+    """
+    prefetch_max_workers = None
+
+    def full_clean(self):
+        if self.is_bound:
+            prefetch_urls(self.forms, self.prefetch_max_workers)
+        super(PrefetchURLsFormSetMixin, self).full_clean()
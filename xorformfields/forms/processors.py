@@ -0,0 +1,192 @@
+"""
+Chunk processors run by FileOrURLField on the bytes of a file as they are
+downloaded or saved to storage, so that hashing or inspecting the file
+doesn't take extra passes over it.
+
+A processor is configured once on the field and copied for every file. Its
+start() is called before the first chunk, update() with every chunk, and the
+results of all the processors end up in the `processed` dict of the file,
+under each processor's `name`.
+"""
+import copy
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import File
+
+from .files import SNIFF_SIZE, sniff_content_type
+
+
+__all__ = ['ChunkProcessor', 'HashProcessor', 'SizeLimitProcessor',
+           'SniffProcessor', 'CallbackProcessor', 'Pipeline', 'process']
+
+
+class ChunkProcessor(object):
+    name = None
+
+    def check(self, content):
+        """
+        Called with the File before any of it is read or stored, to reject
+        it up front when possible.
+        """
+        pass
+
+    def start(self):
+        pass
+
+    def update(self, chunk):
+        raise NotImplementedError
+
+    def result(self):
+        return None
+
+
+class HashProcessor(ChunkProcessor):
+    """ Hex digest of the file with hashlib's `algorithm` """
+    def __init__(self, algorithm='sha256', name=None):
+        self.algorithm = algorithm
+        self.name = name or algorithm
+
+    def start(self):
+        self.digest = hashlib.new(self.algorithm)
+
+    def update(self, chunk):
+        self.digest.update(chunk)
+
+    def result(self):
+        return self.digest.hexdigest()
+
+
+class SizeLimitProcessor(ChunkProcessor):
+    """
+    Size of the file, raising ValidationError as soon as it goes past
+    `max_size` bytes.
+    """
+    name = 'size'
+    error_message = 'The file is too large'
+
+    def __init__(self, max_size, error_message=None):
+        self.max_size = max_size
+        if error_message is not None:
+            self.error_message = error_message
+
+    def check(self, content):
+        if content.size is not None and content.size > self.max_size:
+            raise ValidationError(self.error_message)
+
+    def start(self):
+        self.size = 0
+
+    def update(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise ValidationError(self.error_message)
+
+    def result(self):
+        return self.size
+
+
+class SniffProcessor(ChunkProcessor):
+    """ Content type identified by the magic number of the file, or None """
+    name = 'content_type'
+    header_size = SNIFF_SIZE
+
+    def start(self):
+        self.header = b''
+
+    def update(self, chunk):
+        if len(self.header) < self.header_size:
+            self.header += bytes(chunk[:self.header_size - len(self.header)])
+
+    def result(self):
+        return sniff_content_type(self.header)
+
+
+class CallbackProcessor(ChunkProcessor):
+    """
+    Calls `callback` with every chunk, and `result` (if given) at the end
+    for the value to store under `name`.
+    """
+    def __init__(self, callback, name='callback', result=None):
+        self.callback = callback
+        self.name = name
+        self._result = result
+
+    def update(self, chunk):
+        self.callback(chunk)
+
+    def result(self):
+        if self._result is not None:
+            return self._result()
+        return None
+
+
+class Pipeline(object):
+    """ Fresh copies of `processors`, fed the chunks of one file """
+    def __init__(self, processors):
+        self.processors = [copy.copy(p) for p in processors]
+        for processor in self.processors:
+            processor.start()
+
+    def update(self, chunk):
+        for processor in self.processors:
+            processor.update(chunk)
+
+    def results(self):
+        return dict((p.name, p.result()) for p in self.processors)
+
+
+def process(content, processors):
+    """
+    Runs `processors` over the File `content` in one pass, sets their results
+    as content.processed and returns them.
+    """
+    pipeline = Pipeline(processors)
+    for chunk in content.chunks():
+        pipeline.update(chunk)
+    content.seek(0)
+    content.processed = pipeline.results()
+    return content.processed
+
+
+class ProcessingFile(File):
+    """
+    Wraps the File `content` so that the first pass a storage or hash makes
+    over its chunks() also feeds `processors`. finish() sets the results as
+    content.processed, reading the file only if no full pass happened.
+    `bytes_read` counts the bytes that went through the processors.
+
+    The temporary_file_path() of `content` is kept so storages can still
+    move temporary uploads, in which case the processors read the file in
+    finish() instead.
+    """
+    def __init__(self, content, processors):
+        super(ProcessingFile, self).__init__(content, content.name)
+        self.content = content
+        self.processors = processors
+        for processor in processors:
+            processor.check(content)
+        self.pipeline = Pipeline(processors)
+        self.bytes_read = 0
+        if hasattr(content, 'temporary_file_path'):
+            self.temporary_file_path = content.temporary_file_path
+        content.processed = None
+
+    @property
+    def size(self):
+        return self.content.size
+
+    def chunks(self, chunk_size=None):
+        pipeline, self.pipeline = self.pipeline, None
+        for chunk in super(ProcessingFile, self).chunks(chunk_size):
+            if pipeline is not None:
+                pipeline.update(chunk)
+                self.bytes_read += len(chunk)
+            yield chunk
+        if pipeline is not None:
+            self.content.processed = pipeline.results()
+
+    def finish(self):
+        if getattr(self.content, 'processed', None) is None:
+            process(self.content, self.processors)
+        return self.content.processed
@@ -0,0 +1,232 @@
+"""
+Per-host throttling of the URL fetches made by FileOrURLField.
+
+Each host gets a token bucket, refilled at `rate` fetches per second up to
+`burst`, and a cap of `max_concurrency` fetches in flight. Fetches over
+budget wait up to `max_wait` seconds for a slot and are then rejected with
+FetchRateLimited.
+"""
+from contextlib import contextmanager
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from django.core.signals import setting_changed
+
+from .fetch import FetchRateLimited
+
+
+__all__ = ['RateLimiter', 'CacheRateLimiter', 'get_rate_limiter']
+
+DEFAULT_BACKEND = 'xorformfields.forms.ratelimit.RateLimiter'
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+class RateLimiter(object):
+    """
+    In-process limiter. `rate`, `burst`, `max_concurrency` and `max_wait`
+    apply to every host (None means no limit) and `hosts` maps host names
+    to dicts overriding them for that host.
+
+    The state of up to `max_hosts` hosts is kept, hosts whose bucket is
+    full again and that have no fetch in flight are forgotten first.
+    """
+    max_hosts = 1024
+
+    def __init__(self, rate=None, burst=None, max_concurrency=None,
+                 max_wait=0, hosts=None, max_hosts=None):
+        self.policy = {
+            'rate': rate,
+            'burst': burst,
+            'max_concurrency': max_concurrency,
+            'max_wait': max_wait,
+        }
+        self.hosts = dict((k.lower(), v) for k, v in (hosts or {}).items())
+        if max_hosts is not None:
+            self.max_hosts = max_hosts
+        self._lock = threading.Lock()
+        # host -> (tokens, last update, time the bucket is full again)
+        self._buckets = {}
+        # host -> [semaphore, number of fetches using it]
+        self._semaphores = {}
+        self.check_policy(None, self.policy)
+        for host, policy in self.hosts.items():
+            self.check_policy(host, policy)
+
+    def check_policy(self, host, policy):
+        """ Raises ImproperlyConfigured for limits that can't be enforced """
+        for key, valid in (('rate', lambda v: v > 0),
+                           ('burst', lambda v: v >= 1),
+                           ('max_concurrency', lambda v: v >= 1),
+                           ('max_wait', lambda v: v >= 0)):
+            value = policy.get(key)
+            if value is not None and not (isinstance(value, (int, float))
+                                          and valid(value)):
+                raise ImproperlyConfigured(
+                    'Invalid %s %r for %s in the rate limiter' % (
+                        key, value, host or 'all hosts'))
+
+    def get_policy(self, host):
+        policy = dict(self.policy)
+        policy.update(self.hosts.get(host, {}))
+        if policy['rate'] is not None and not policy['burst']:
+            policy['burst'] = max(1, policy['rate'])
+        return policy
+
+    def take_token(self, host, policy):
+        """
+        Takes a token from the bucket of `host` and returns 0, or returns the
+        number of seconds until one is available.
+        """
+        rate, burst = policy['rate'], float(policy['burst'])
+        now = time.time()
+        with self._lock:
+            if (host not in self._buckets and
+                    len(self._buckets) >= self.max_hosts):
+                self.prune_buckets(now)
+            tokens, last, _ = self._buckets.get(host, (burst, now, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            delay = 0 if tokens >= 1 else (1 - tokens) / float(rate)
+            if not delay:
+                tokens -= 1
+            self._buckets[host] = (tokens, now,
+                                   now + (burst - tokens) / float(rate))
+        return delay
+
+    def prune_buckets(self, now):
+        # a full bucket is the same as no bucket
+        for host in [host for host, (_, _, full) in self._buckets.items()
+                     if full <= now]:
+            del self._buckets[host]
+        if len(self._buckets) >= self.max_hosts:
+            self._buckets.clear()
+
+    def get_semaphore(self, host, policy):
+        """
+        Returns the semaphore capping the fetches to `host`, or None. Every
+        call must be matched by a call to put_semaphore().
+        """
+        if policy['max_concurrency'] is None:
+            return None
+        with self._lock:
+            entry = self._semaphores.get(host)
+            if entry is None:
+                if len(self._semaphores) >= self.max_hosts:
+                    # semaphores in use have to be kept
+                    for idle in [h for h, (_, users) in
+                                 self._semaphores.items() if not users]:
+                        del self._semaphores[idle]
+                entry = self._semaphores[host] = [threading.BoundedSemaphore(
+                    policy['max_concurrency']), 0]
+            entry[1] += 1
+        return entry[0]
+
+    def put_semaphore(self, host):
+        with self._lock:
+            self._semaphores[host][1] -= 1
+
+    @contextmanager
+    def limit(self, url):
+        """
+        Holds one of the fetch slots of the host of `url` for the duration
+        of the block, raising FetchRateLimited if none is free in time.
+        With max_wait=None, it waits for one as long as it takes.
+        """
+        host = (urlsplit(url).hostname or '').lower()
+        policy = self.get_policy(host)
+        max_wait = policy['max_wait']
+        deadline = None if max_wait is None else time.time() + max_wait
+        semaphore = self.get_semaphore(host, policy)
+        try:
+            if semaphore is not None:
+                if max_wait is None:
+                    acquired = semaphore.acquire()
+                elif max_wait:
+                    acquired = semaphore.acquire(True, max_wait)
+                else:
+                    acquired = semaphore.acquire(False)
+                if not acquired:
+                    raise FetchRateLimited(host)
+            try:
+                while policy['rate'] is not None:
+                    delay = self.take_token(host, policy)
+                    if not delay:
+                        break
+                    if deadline is not None and time.time() + delay > deadline:
+                        raise FetchRateLimited(host)
+                    time.sleep(delay)
+                yield
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+        finally:
+            if semaphore is not None:
+                self.put_semaphore(host)
+
+
+class CacheRateLimiter(RateLimiter):
+    """
+    Shares the fetch budget of each host between processes through one of
+    the CACHES. The bucket is approximated by counting fetches in fixed
+    windows of `burst / rate` seconds, which needs an atomic incr() from the
+    cache backend (eg: memcached or redis). Concurrency caps stay per
+    process.
+    """
+    def __init__(self, alias='default', key_prefix='xorformfields:rate',
+                 **kwargs):
+        super(CacheRateLimiter, self).__init__(**kwargs)
+        self.alias = alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def take_token(self, host, policy):
+        window = policy['burst'] / float(policy['rate'])
+        now = time.time()
+        start = int(now / window)
+        key = '%s:%s:%d' % (self.key_prefix, host, start)
+        self.cache.add(key, 0, int(window) + 1)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:
+            # expired between add() and incr()
+            self.cache.add(key, 1, int(window) + 1)
+            count = 1
+        if count <= policy['burst']:
+            return 0
+        return (start + 1) * window - now
+
+
+def get_rate_limiter():
+    """
+    Returns the limiter configured by the XORFORMFIELDS_RATE_LIMIT setting,
+    or None. The setting is a dict with OPTIONS passed as keyword arguments
+    to its BACKEND dotted path (defaults to RateLimiter).
+    """
+    global _default_limiter
+    config = getattr(settings, 'XORFORMFIELDS_RATE_LIMIT', None)
+    if not config:
+        return None
+    if _default_limiter is None:
+        with _default_limiter_lock:
+            if _default_limiter is None:
+                backend = import_string(config.get('BACKEND', DEFAULT_BACKEND))
+                _default_limiter = backend(**config.get('OPTIONS', {}))
+    return _default_limiter
+
+
+def _reset_limiter(setting, **kwargs):
+    global _default_limiter
+    if setting == 'XORFORMFIELDS_RATE_LIMIT':
+        _default_limiter = None
+
+setting_changed.connect(_reset_limiter)
+
@@ -0,0 +1,172 @@
+"""
+Host name resolution for the URL fetches made by FileOrURLField.
+
+The session built by build_session() resolves each host once through a
+Resolver, which caches the lookup and checks every address against its
+policy, then connects to exactly the address it checked. A host can't be
+made to pass the check with a public address and then connect to an
+internal one (DNS rebinding), and busy hosts aren't looked up on every new
+connection.
+"""
+import ipaddress
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django.core.signals import setting_changed
+
+from .fetch import FetchAddressBlocked
+
+
+__all__ = ['Resolver', 'get_resolver', 'pinned_adapter']
+
+DEFAULT_BACKEND = 'xorformfields.forms.resolver.Resolver'
+
+_default_resolver = None
+_default_resolver_lock = threading.Lock()
+
+
+class Resolver(object):
+    """
+    Resolves host names with `getaddrinfo` (defaults to the socket module's)
+    and caches the addresses of up to `max_entries` hosts for `ttl` seconds.
+
+    Every address of a host must pass the policy: addresses in one of the
+    `allow` networks always do, then those in one of the `deny` networks
+    don't. `deny` defaults to every address that isn't globally reachable
+    (private, loopback, link-local, multicast, reserved...).
+    """
+    max_entries = 1024
+
+    def __init__(self, ttl=60, allow=None, deny=None, max_entries=None,
+                 getaddrinfo=None):
+        self.ttl = ttl
+        self.allow = [ipaddress.ip_network(str(n)) for n in allow or ()]
+        self.deny = (None if deny is None else
+                     [ipaddress.ip_network(str(n)) for n in deny])
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self.getaddrinfo = getaddrinfo or socket.getaddrinfo
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def is_allowed(self, address):
+        address = ipaddress.ip_address(str(address))
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if any(address in network for network in self.allow):
+            return True
+        if self.deny is None:
+            return address.is_global and not address.is_multicast
+        return not any(address in network for network in self.deny)
+
+    def lookup(self, host, port):
+        """ Returns the addresses of `host`, from the cache if fresh """
+        now = time.time()
+        with self._lock:
+            addresses, expiry = self._cache.get(host, (None, 0))
+        if expiry > now:
+            return addresses
+        addresses = []
+        for info in self.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+            address = info[4][0]
+            if address not in addresses:
+                addresses.append(address)
+        with self._lock:
+            if len(self._cache) >= self.max_entries:
+                self._cache.clear()
+            self._cache[host] = (addresses, now + self.ttl)
+        return addresses
+
+    def resolve(self, host, port=None):
+        """
+        Returns the addresses to connect to for `host`, raising
+        FetchAddressBlocked if any of them isn't allowed.
+        """
+        host = host.strip('[]').rstrip('.').lower()
+        try:
+            addresses = [str(ipaddress.ip_address(str(host)))]
+        except ValueError:
+            addresses = self.lookup(host, port)
+        if not addresses or not all(self.is_allowed(a) for a in addresses):
+            raise FetchAddressBlocked(host)
+        return addresses
+
+
+def _pinned_connection(base, resolver):
+    class PinnedConnection(base):
+        def _new_conn(self):
+            # connect to the checked addresses, self.host stays the host name
+            # for the Host header and TLS
+            addresses = resolver.resolve(self.host, self.port)
+            dns_host = self._dns_host
+            try:
+                for i, address in enumerate(addresses):
+                    self._dns_host = address
+                    try:
+                        return super(PinnedConnection, self)._new_conn()
+                    except Exception:
+                        if i == len(addresses) - 1:
+                            raise
+            finally:
+                self._dns_host = dns_host
+
+    PinnedConnection.__name__ = 'Pinned' + base.__name__
+    return PinnedConnection
+
+
+def pinned_adapter(resolver, **kwargs):
+    """
+    Returns a requests HTTPAdapter (built with `kwargs`) whose connections
+    go to the addresses returned by resolver.resolve(). Requests sent
+    through a proxy leave resolving the host to the proxy.
+    """
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    pool_classes = {}
+    for scheme, pool, connection in (
+            ('http', HTTPConnectionPool, HTTPConnection),
+            ('https', HTTPSConnectionPool, HTTPSConnection)):
+        pool_classes[scheme] = type(
+            'Pinned' + pool.__name__, (pool,),
+            {'ConnectionCls': _pinned_connection(connection, resolver)})
+
+    class PinnedHTTPAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kw):
+            super(PinnedHTTPAdapter, self).init_poolmanager(*args, **kw)
+            self.poolmanager.pool_classes_by_scheme = pool_classes
+
+    adapter = PinnedHTTPAdapter(**kwargs)
+    adapter.resolver = resolver
+    return adapter
+
+
+def get_resolver():
+    """
+    Returns the resolver configured by the XORFORMFIELDS_RESOLVER setting, a
+    dict with OPTIONS passed as keyword arguments to its BACKEND dotted path
+    (defaults to Resolver). Setting it to None turns the resolver off.
+    """
+    global _default_resolver
+    config = getattr(settings, 'XORFORMFIELDS_RESOLVER', {})
+    if config is None:
+        return None
+    if _default_resolver is None:
+        with _default_resolver_lock:
+            if _default_resolver is None:
+                backend = import_string(config.get('BACKEND',
+                                                   DEFAULT_BACKEND))
+                _default_resolver = backend(**config.get('OPTIONS', {}))
+    return _default_resolver
+
+
+def _reset_resolver(setting, **kwargs):
+    global _default_resolver
+    if setting == 'XORFORMFIELDS_RESOLVER':
+        _default_resolver = None
+
+setting_changed.connect(_reset_resolver)
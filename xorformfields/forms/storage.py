@@ -0,0 +1,311 @@
+"""
+Helpers used by FileOrURLField(to='url') to store uploads.
+"""
+import copy
+import hashlib
+import os
+import posixpath
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+from django.conf import settings
+from django.core.files.base import File
+from django.utils.functional import LazyObject, empty
+from django.utils.module_loading import import_string
+from django.core.signals import setting_changed
+
+from ..signals import storage_finished, timed
+from .processors import ProcessingFile
+
+
+__all__ = ['content_hash', 'hashed_name', 'save', 'defer_save', 'StoredURL',
+           'PendingURL', 'ImmediateExecutor', 'get_upload_executor',
+           'unsigned_storage', 'storage_url', 'DeferredSaveError']
+
+DEFAULT_UPLOAD_WORKERS = 4
+URL_CACHE_SIZE = 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# storage -> copy of it without querystring auth
+_unsigned_storages = weakref.WeakKeyDictionary()
+# storage -> {path: (url, expiry)}
+_url_caches = weakref.WeakKeyDictionary()
+_storage_lock = threading.Lock()
+
+
+def content_hash(content, algorithm='sha256'):
+    """ Hashes the File `content` chunk by chunk """
+    digest = hashlib.new(algorithm)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def hashed_name(content, upload_to):
+    """
+    Returns a name under `upload_to` derived from the content of `content`,
+    keeping its extension.
+    """
+    ext = os.path.splitext(content.name or '')[1].lower()
+    return posixpath.join(upload_to, content_hash(content) + ext)
+
+
+def save(storage, upload_to, content, hash_names=False, processors=None):
+    """
+    Streams `content` to `storage` under `upload_to` and returns its path.
+    With `hash_names`, the file is named after the hash of its content and
+    isn't written again if the storage already has it.
+    `processors` are fed the chunks read for the hash or the save, whichever
+    comes first, and their results are set as content.processed.
+    """
+    if processors:
+        content = ProcessingFile(content, processors)
+    if hash_names:
+        name = hashed_name(content, upload_to)
+        exists = storage.exists(name)
+    else:
+        name = posixpath.join(upload_to, content.name)
+        exists = False
+    if not exists:
+        with timed(storage_finished, storage.__class__, storage=storage,
+                   name=name, deferred=False) as timer:
+            timer.bytes = content.size
+            if processors:
+                name = _save_processing(storage, name, content)
+            else:
+                name = storage.save(name, content)
+    if processors:
+        content.finish()
+    return name
+
+
+def _save_processing(storage, name, content):
+    """
+    storage.save() for the ProcessingFile `content`, deleting what was
+    stored if one of the processors rejects the file.
+    """
+    name = storage.get_available_name(name)
+    try:
+        saved = storage.save(name, content)
+    except Exception:
+        # the name could have been taken by another upload in the meantime,
+        # only delete a file the size of what was written
+        try:
+            partial = (storage.exists(name) and
+                       storage.size(name) == content.bytes_read)
+        except Exception:
+            partial = False
+        if partial:
+            storage.delete(name)
+        raise
+    try:
+        content.finish()
+    except Exception:
+        storage.delete(saved)
+        raise
+    return saved
+
+
+def _unwrap(storage):
+    # default_storage is a LazyObject whose copies would build a new storage
+    if isinstance(storage, LazyObject):
+        if storage._wrapped is empty:
+            storage._setup()
+        return storage._wrapped
+    return storage
+
+
+def unsigned_storage(storage):
+    """
+    Returns a copy of `storage` with querystring_auth disabled (for
+    django-storages backends), so its URLs aren't signed. `storage` itself
+    is left alone, it's shared by every thread.
+    """
+    storage = _unwrap(storage)
+    try:
+        return _unsigned_storages[storage]
+    except KeyError:
+        pass
+    unsigned = copy.copy(storage)
+    unsigned.querystring_auth = False
+    with _storage_lock:
+        return _unsigned_storages.setdefault(storage, unsigned)
+
+
+def storage_url(storage, path, ttl=None):
+    """
+    Returns storage.url(path). With a `ttl`, the URL is reused for that many
+    seconds instead of being generated (and maybe signed) again, keep it
+    shorter than the lifetime of signed URLs.
+    """
+    if not ttl:
+        return storage.url(path)
+    storage = _unwrap(storage)
+    now = time.time()
+    with _storage_lock:
+        cache = _url_caches.get(storage)
+        if cache is None:
+            cache = _url_caches[storage] = {}
+        try:
+            url, expiry = cache[path]
+        except KeyError:
+            expiry = 0
+    if expiry > now:
+        return url
+    url = storage.url(path)
+    with _storage_lock:
+        if len(cache) >= URL_CACHE_SIZE:
+            cache.clear()
+        cache[path] = (url, now + ttl)
+    return url
+
+
+class StoredURL(str):
+    """ The URL of a stored file, with the results of its `processed` """
+    def __new__(cls, url, processed=None):
+        obj = super(StoredURL, cls).__new__(cls, url)
+        obj.processed = processed
+        return obj
+
+
+class PendingURL(StoredURL):
+    """
+    The URL of a file whose upload to storage is still in progress. It can be
+    used as a plain string right away, wait() blocks until the file is
+    stored (raising any error the upload ran into) and done() checks on it.
+    """
+    def __new__(cls, url, future, processed=None):
+        obj = super(PendingURL, cls).__new__(cls, url, processed)
+        obj.future = future
+        return obj
+
+    def done(self):
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        self.future.result(timeout)
+        return self
+
+
+class ImmediateExecutor(object):
+    """
+    Executor running submitted uploads right away in the calling thread,
+    for tests and local development.
+    """
+    def submit(self, fn, *args, **kwargs):
+        from concurrent.futures import Future
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def get_upload_executor():
+    """
+    Returns the executor deferred uploads are submitted to. It is built by
+    the callable at the dotted path in the XORFORMFIELDS_UPLOAD_EXECUTOR
+    setting, or is a pool of XORFORMFIELDS_UPLOAD_WORKERS threads. Any object
+    with a concurrent.futures style submit() will do, so uploads can be
+    handed to a task queue.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                path = getattr(settings, 'XORFORMFIELDS_UPLOAD_EXECUTOR',
+                               None)
+                if path:
+                    _executor = import_string(path)()
+                else:
+                    from concurrent.futures import ThreadPoolExecutor
+                    _executor = ThreadPoolExecutor(max_workers=getattr(
+                        settings, 'XORFORMFIELDS_UPLOAD_WORKERS',
+                        DEFAULT_UPLOAD_WORKERS))
+    return _executor
+
+
+def _reset_executor(setting, **kwargs):
+    global _executor
+    if setting in ('XORFORMFIELDS_UPLOAD_EXECUTOR',
+                   'XORFORMFIELDS_UPLOAD_WORKERS'):
+        _executor = None
+
+setting_changed.connect(_reset_executor)
+
+
+class DeferredSaveError(Exception):
+    """
+    Raised by a deferred save when the storage picked another name than the
+    one the URL was already handed out for.
+    """
+
+
+def _save_copy(storage, name, spool, size, hash_names=False):
+    try:
+        with timed(storage_finished, storage.__class__, storage=storage,
+                   name=name, deferred=True) as timer:
+            timer.bytes = size
+            saved = storage.save(name, File(spool, name))
+    finally:
+        spool.close()
+    if saved != name:
+        # the URL handed out points to some other file, don't keep this one
+        storage.delete(saved)
+        if hash_names and storage.exists(name):
+            # an upload of the same content got there first
+            return name
+        raise DeferredSaveError(saved)
+    return saved
+
+
+def defer_save(storage, upload_to, content, executor, hash_names=False,
+               processors=None):
+    """
+    Works out the name `content` will be saved under and submits the actual
+    save to `executor`. Returns the name and the future of the save.
+
+    The content is first copied to a local spooled file because the upload
+    is closed once the request is over. Without `hash_names` the file goes
+    in a directory named after a random uuid, so uploads with the same name
+    don't end up with the same URL, and the save fails with
+    DeferredSaveError if the storage still picks another name. With
+    `hash_names`, another name is fine as long as the storage has a file
+    under the hashed one. `processors` run as in save(), during the hash or
+    the copy.
+    """
+    if processors:
+        content = ProcessingFile(content, processors)
+    result = _defer_save(storage, upload_to, content, executor, hash_names)
+    if processors:
+        content.finish()
+    return result
+
+
+def _defer_save(storage, upload_to, content, executor, hash_names):
+    if hash_names:
+        name = hashed_name(content, upload_to)
+        if storage.exists(name):
+            from concurrent.futures import Future
+            future = Future()
+            future.set_result(name)
+            return name, future
+    else:
+        name = storage.get_available_name(posixpath.join(
+            upload_to, uuid.uuid4().hex, content.name))
+    spool = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    size = 0
+    for chunk in content.chunks():
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return name, executor.submit(_save_copy, storage, name, spool, size,
+                                 hash_names)
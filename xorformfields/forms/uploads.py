@@ -0,0 +1,268 @@
+"""
+Storage for chunked uploads, which send a file to the upload view in ranges
+instead of in the form's request body. The form then submits the upload's
+token, which FileOrURLWidget resolves to the assembled file.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import locks
+from django.core.files.uploadedfile import UploadedFile
+from django.utils.module_loading import import_string
+from django.core.signals import setting_changed
+
+
+__all__ = ['ChunkedUploadStore', 'ChunkedUploadedFile', 'UploadError',
+           'UploadOffsetError', 'get_upload_store', 'upload_permitted']
+
+DEFAULT_BACKEND = 'xorformfields.forms.uploads.ChunkedUploadStore'
+DEFAULT_CHUNK_SIZE = 64 * 2 ** 10
+DEFAULT_MAX_SIZE = 2 ** 30
+
+_token_re = re.compile(r'^[0-9a-f]{32}$')
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """ Raised for unknown uploads and invalid chunks """
+
+
+class UploadOffsetError(UploadError):
+    """
+    Raised when a chunk doesn't start where the upload stopped, `offset` is
+    where the next chunk has to start.
+    """
+    def __init__(self, offset):
+        super(UploadOffsetError, self).__init__(offset)
+        self.offset = offset
+
+
+class ChunkedUploadedFile(UploadedFile):
+    """
+    A finished chunked upload, read from the file it was assembled in. The
+    file is only opened once its content is accessed, widgets build one
+    every time the form's data is read.
+    """
+    def __init__(self, path, token, name, content_type, size):
+        super(ChunkedUploadedFile, self).__init__(
+            None, name, content_type, size)
+        self.token = token
+        self.path = path
+
+    def _get_file(self):
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        return self._file
+
+    def _set_file(self, file):
+        self._file = file
+    file = property(_get_file, _set_file)
+
+    @property
+    def closed(self):
+        return self._file is None or self._file.closed
+
+    def open(self, mode='rb'):
+        if self.closed:
+            self._file = open(self.path, mode)
+        else:
+            self._file.seek(0)
+        return self
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def temporary_file_path(self):
+        return self.path
+
+
+class ChunkedUploadStore(object):
+    """
+    Assembles chunked uploads in a local `directory` (defaults to a
+    subdirectory of FILE_UPLOAD_TEMP_DIR). Uploads can't grow past
+    `max_size` bytes (1GB by default, None for no limit) and are deleted
+    `expiry` seconds after their last chunk, whether they were used or not.
+    """
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE,
+                 expiry=24 * 60 * 60):
+        if directory is None:
+            directory = os.path.join(
+                settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir(),
+                'xorformfields-uploads')
+        self.directory = directory
+        self.max_size = max_size
+        self.expiry = expiry
+        self._lock = threading.Lock()
+
+    def _path(self, token, ext):
+        if not _token_re.match(token or ''):
+            raise UploadError(token)
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        return os.path.join(self.directory, token + ext)
+
+    def get_meta(self, token):
+        """ Returns the upload's name, content_type and size, or None """
+        try:
+            with open(self._path(token, '.json')) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError, UploadError):
+            return None
+
+    def create(self, name, size, content_type=None):
+        """ Starts an upload of `size` bytes and returns its token """
+        if self.max_size is not None and size > self.max_size:
+            raise UploadError(size)
+        self.cleanup()
+        token = uuid.uuid4().hex
+        meta = {'name': os.path.basename(name or ''), 'size': size,
+                'content_type': content_type or None}
+        open(self._path(token, '.part'), 'wb').close()
+        with open(self._path(token, '.json'), 'w') as f:
+            json.dump(meta, f)
+        return token
+
+    def offset(self, token):
+        """ Returns the number of bytes received for the upload """
+        if self.get_meta(token) is None:
+            raise UploadError(token)
+        try:
+            return os.path.getsize(self._path(token, '.part'))
+        except OSError:
+            raise UploadError(token)
+
+    def write(self, token, offset, stream, length,
+              chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Appends `length` bytes read from `stream` to the upload, which must
+        have received exactly `offset` bytes so far. Returns the new offset.
+        """
+        meta = self.get_meta(token)
+        if meta is None:
+            raise UploadError(token)
+        if offset + length > meta['size']:
+            raise UploadError(offset + length)
+        path = self._path(token, '.part')
+        try:
+            f = open(path, 'r+b')
+        except (IOError, OSError):
+            raise UploadError(token)
+        # the file lock keeps other processes out, the thread lock other
+        # threads where file locks aren't supported
+        with f, self._lock:
+            locks.lock(f, locks.LOCK_EX)
+            try:
+                current = os.fstat(f.fileno()).st_size
+                if offset != current:
+                    raise UploadOffsetError(current)
+                f.seek(current)
+                remaining = length
+                while remaining:
+                    chunk = stream.read(min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    remaining -= len(chunk)
+                f.flush()
+            finally:
+                locks.unlock(f)
+        if remaining:
+            # the connection dropped, what arrived is kept for the retry
+            raise UploadOffsetError(offset + length - remaining)
+        return offset + length
+
+    def open(self, token):
+        """
+        Returns the finished upload as a ChunkedUploadedFile, or None if it
+        doesn't exist or is incomplete.
+        """
+        meta = self.get_meta(token)
+        if meta is None:
+            return None
+        try:
+            if self.offset(token) != meta['size']:
+                return None
+        except UploadError:
+            return None
+        return ChunkedUploadedFile(
+            self._path(token, '.part'), token, meta['name'],
+            meta['content_type'], meta['size'])
+
+    def delete(self, token):
+        for ext in ('.json', '.part'):
+            try:
+                os.remove(self._path(token, ext))
+            except (OSError, UploadError):
+                pass
+
+    def cleanup(self):
+        """ Deletes the uploads that expired """
+        if not os.path.isdir(self.directory):
+            return
+        deadline = time.time() - self.expiry
+        for filename in os.listdir(self.directory):
+            token, ext = os.path.splitext(filename)
+            if ext != '.json':
+                continue
+            try:
+                # the part is gone once a storage moved it somewhere else
+                path = self._path(token, '.part')
+                if not os.path.exists(path):
+                    path = self._path(token, '.json')
+                expired = os.path.getmtime(path) < deadline
+            except (OSError, UploadError):
+                continue
+            if expired:
+                self.delete(token)
+
+
+def get_upload_store():
+    """
+    Returns the store configured by the XORFORMFIELDS_CHUNKED_UPLOADS
+    setting, a dict with OPTIONS passed as keyword arguments to its BACKEND
+    dotted path (defaults to ChunkedUploadStore).
+    """
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                config = getattr(settings, 'XORFORMFIELDS_CHUNKED_UPLOADS',
+                                 None) or {}
+                backend = import_string(config.get('BACKEND',
+                                                   DEFAULT_BACKEND))
+                _default_store = backend(**config.get('OPTIONS', {}))
+    return _default_store
+
+
+def upload_permitted(request):
+    """
+    Returns whether `request` may use the chunked upload view. The
+    PERMISSION key of the XORFORMFIELDS_CHUNKED_UPLOADS setting is the
+    dotted path of a callable taking the request and returning a bool,
+    everyone is allowed without it.
+    """
+    config = getattr(settings, 'XORFORMFIELDS_CHUNKED_UPLOADS', None) or {}
+    if not config.get('PERMISSION'):
+        return True
+    return import_string(config['PERMISSION'])(request)
+
+
+def _reset_store(setting, **kwargs):
+    global _default_store
+    if setting in ('XORFORMFIELDS_CHUNKED_UPLOADS', 'FILE_UPLOAD_TEMP_DIR'):
+        _default_store = None
+
+setting_changed.connect(_reset_store)
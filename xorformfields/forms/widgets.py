@@ -1,60 +1,106 @@
-from django.forms.widgets import MultiWidget, FileInput, URLInput, RadioSelect
+import copy
+
+from django.forms.widgets import (
+    ChoiceWidget, MultiWidget, FileInput, URLInput, Input, Media, Widget)
 from django.core.validators import EMPTY_VALUES
-from django.utils.safestring import mark_safe
 from django.core.files.uploadedfile import UploadedFile
-
 try:
-    unicode
-except NameError:
-    unicode = str
+    from django.forms.widgets import Script
+except ImportError:
+    Script = None
 
 __all__ = ['MutuallyExclusiveRadioWidget',
-           'FileOrURLWidget']
+           'FileOrURLWidget',
+           'KeyedExclusiveRadioWidget']
+
+RADIO_CACHE_SIZE = 1024
+CHUNKED_UPLOAD_CHUNK_SIZE = 2 ** 20
+
+_radio_cache = {}
+
+
+def deferred_script(path):
+    """ A Media js entry loaded with the defer attribute when supported """
+    if Script is None:
+        return path
+    return Script(path, defer=True)
+
+
+class RadioInput(Input):
+    input_type = 'radio'
+
+
+def render_radio(name, checked, value=None):
+    """
+    Returns the markup of the radio button for `name`. It only depends on the
+    name, value and whether it's checked, so it's rendered once and then
+    cached.
+    """
+    key = (name, checked, value)
+    try:
+        return _radio_cache[key]
+    except KeyError:
+        pass
+    html = RadioInput().render(name, value or '',
+                               {'checked': ''} if checked else {})
+    if len(_radio_cache) >= RADIO_CACHE_SIZE:
+        _radio_cache.clear()
+    _radio_cache[key] = html
+    return html
+
+
+# widgets copied by these are safe to copy with copy_widget()
+_SHALLOW_DEEPCOPIES = (Widget.__deepcopy__, ChoiceWidget.__deepcopy__)
+
+
+def copy_widget(widget, memo):
+    """
+    Copies `widget` for a new form like deepcopy() does, but shares the
+    choices of choice widgets instead of copying them: assigning new choices
+    to the copy works as usual, changing them in place affects every form.
+    Widgets with their own __deepcopy__ are deep-copied.
+    """
+    if type(widget).__deepcopy__ not in _SHALLOW_DEEPCOPIES:
+        return copy.deepcopy(widget, memo)
+    result = copy.copy(widget)
+    result.attrs = widget.attrs.copy()
+    memo[id(widget)] = result
+    return result
 
 
 class MutuallyExclusiveRadioWidget(MultiWidget):
-    def render(self, name, value, attrs=None, renderer=None):
-        if self.is_localized:
-            for widget in self.widgets:
-                widget.is_localized = self.is_localized
+    template_name = 'xorformfields/widgets/mutually_exclusive_radio.html'
+
+    def __deepcopy__(self, memo):
+        result = copy.copy(self)
+        result.attrs = self.attrs.copy()
+        memo[id(self)] = result
+        result.widgets = [copy_widget(w, memo) for w in self.widgets]
+        return result
+
+    def get_context(self, name, value, attrs):
         # value is a list of values, each corresponding to a widget
         # in self.widgets.
         if not isinstance(value, list):
             value = self.decompress(value)
-        output = []
-        final_attrs = self.build_attrs(attrs)
-        id_ = final_attrs.get('id', None)
+        context = super(MutuallyExclusiveRadioWidget, self).get_context(
+            name, value, attrs)
         nonempty_widget = 0
-        for i, widget in enumerate(self.widgets):
-            try:
-                widget_value = value[i]
-            except IndexError:
-                widget_value = None
-            else:
-                if widget_value not in EMPTY_VALUES:
-                    nonempty_widget = i
-            if id_:
-                final_attrs = dict(final_attrs, id='%s_%s' % (id_, i))
-            output.append(widget.render(
-                name + '_%s' % i, widget_value, final_attrs))
-        return mark_safe(unicode(
-            self.format_output(nonempty_widget, name, output)))
-
-    def format_output(self, nonempty_widget, name, rendered_widgets):
-        radio_widgets = [RadioSelect().render(
-            name + '_radio', '', {})] * len(rendered_widgets)
-        if nonempty_widget is not None:
-            radio_widgets[nonempty_widget] = RadioSelect().render(
-                name + '_radio', '', {'checked': ''})
-        tpl = """
-<span id="{name}_container" class="mutually-exclusive-widget"
-    style="display:inline-block">
-    {widgets}
-</span>"""
-
-        return tpl.format(name=name, widgets='<br>'.join(
-            '<span>{0}</span>'.format(x + y)
-            for x, y in zip(radio_widgets, rendered_widgets)))
+        for i, widget_value in enumerate(value[:len(self.widgets)]):
+            if widget_value not in EMPTY_VALUES:
+                nonempty_widget = i
+        for i, subwidget in enumerate(context['widget']['subwidgets']):
+            subwidget['radio'] = render_radio(
+                name + '_radio', i == nonempty_widget, self.radio_value(i))
+        return context
+
+    def radio_value(self, i):
+        """ Returns the value submitted by the radio of the i-th widget """
+        return None
+
+    def use_required_attribute(self, initial):
+        # only one of the alternatives is filled in
+        return False
 
     def decompress(self, value):
         """
@@ -64,17 +110,48 @@ class MutuallyExclusiveRadioWidget(MultiWidget):
         return [''] * len(self.widgets)
 
     class Media:
-        js = ('mutually_exclusive_widget.js',)
+        js = (deferred_script('mutually_exclusive_widget.js'),)
 
 
 class FileOrURLWidget(MutuallyExclusiveRadioWidget):
-    def __init__(self, attrs=None):
+    """
+    With `chunked`, the shipped chunked_upload.js sends selected files to the
+    chunked upload view (`upload_url`, defaults to the one in
+    xorformfields.urls) in chunks of `chunk_size` bytes, and the form submits
+    the upload's token as `<name>_token` instead of the file.
+    """
+    def __init__(self, attrs=None, chunked=False, upload_url=None,
+                 chunk_size=None):
         url_attrs = dict(placeholder='Enter URL')
         if attrs is not None:
             url_attrs.update(attrs)
         widgets = (FileInput(attrs=attrs), URLInput(attrs=url_attrs))
+        self.chunked = chunked
+        self.upload_url = upload_url
+        self.chunk_size = chunk_size or CHUNKED_UPLOAD_CHUNK_SIZE
         super(FileOrURLWidget, self).__init__(widgets, attrs)
 
+    def get_context(self, name, value, attrs):
+        context = super(FileOrURLWidget, self).get_context(name, value, attrs)
+        if self.chunked:
+            upload_url = self.upload_url
+            if upload_url is None:
+                from django.urls import reverse
+                upload_url = reverse('xorformfields:chunked_upload')
+            context['widget']['subwidgets'][0]['attrs'].update({
+                'data-chunked-upload': upload_url,
+                'data-chunk-size': self.chunk_size,
+                'data-token-name': name + '_token',
+            })
+        return context
+
+    def _get_media(self):
+        media = super(FileOrURLWidget, self).media
+        if self.chunked:
+            media = media + Media(js=(deferred_script('chunked_upload.js'),))
+        return media
+    media = property(_get_media)
+
     def decompress(self, value):
         if isinstance(value, UploadedFile):
             return [value, '']
@@ -88,6 +165,74 @@ class FileOrURLWidget(MutuallyExclusiveRadioWidget):
             return self.decompress(data[name])
         elif name in files:
             return self.decompress(files[name])
-        else:
-            return super(FileOrURLWidget, self).value_from_datadict(
-                data, files, name)
+        value = super(FileOrURLWidget, self).value_from_datadict(
+            data, files, name)
+        token = self.chunked and data.get(name + '_token')
+        if token and value[0] in EMPTY_VALUES:
+            # unknown or unfinished uploads are ignored
+            from .uploads import get_upload_store
+            upload = get_upload_store().open(token)
+            if upload is not None:
+                value[0] = upload
+        return value
+
+
+class KeyedExclusiveRadioWidget(MutuallyExclusiveRadioWidget):
+    """
+    Radio widget whose alternatives are named by key instead of position.
+    `widgets` is a dict, or a list of (key, widget) pairs. Subwidgets are
+    named `<name>_<key>` and each radio submits its key as `<name>_radio`,
+    so value_from_datadict only has to read the selected subwidget.
+
+    Its values are dicts of {key: value}: the selected alternative only, or
+    if no radio was submitted (eg: API clients), all the non-empty ones.
+    """
+    def __init__(self, widgets, attrs=None):
+        if isinstance(widgets, dict):
+            widgets = widgets.items()
+        widgets = list(widgets)
+        self.keys = [key for key, _ in widgets]
+        self.key_indexes = dict((key, i) for i, key in enumerate(self.keys))
+        super(KeyedExclusiveRadioWidget, self).__init__(
+            dict(widgets), attrs)
+
+    def radio_value(self, i):
+        return self.keys[i]
+
+    def selected_key(self, value):
+        if isinstance(value, dict) and len(value) == 1:
+            return list(value)[0]
+        elif isinstance(value, tuple) and hasattr(value, 'key'):
+            return value.key
+        return None
+
+    def get_context(self, name, value, attrs):
+        key = self.selected_key(value)
+        context = super(KeyedExclusiveRadioWidget, self).get_context(
+            name, value, attrs)
+        if key in self.key_indexes:
+            for i, subwidget in enumerate(context['widget']['subwidgets']):
+                subwidget['radio'] = render_radio(
+                    name + '_radio', self.keys[i] == key, self.keys[i])
+        return context
+
+    def decompress(self, value):
+        if isinstance(value, tuple) and hasattr(value, 'key'):
+            value = {value.key: value.value}
+        if not isinstance(value, dict):
+            value = {}
+        return [value.get(key) for key in self.keys]
+
+    def value_from_datadict(self, data, files, name):
+        key = data.get(name + '_radio')
+        if key in self.key_indexes:
+            widget = self.widgets[self.key_indexes[key]]
+            return {key: widget.value_from_datadict(
+                data, files, '%s_%s' % (name, key))}
+        values = {}
+        for key, widget in zip(self.keys, self.widgets):
+            widget_value = widget.value_from_datadict(
+                data, files, '%s_%s' % (name, key))
+            if widget_value not in EMPTY_VALUES:
+                values[key] = widget_value
+        return values
@@ -0,0 +1,90 @@
+"""
+In-process aggregation of the timings sent by xorformfields.signals, to be
+exported to a metrics system.
+"""
+import threading
+
+from .signals import clean_finished, fetch_finished, storage_finished
+
+
+__all__ = ['HistogramCollector', 'DEFAULT_BUCKETS']
+
+# upper bounds, in seconds, of the duration histogram buckets
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10,
+                   float('inf'))
+
+PHASES = (
+    ('clean', clean_finished),
+    ('fetch', fetch_finished),
+    ('storage', storage_finished),
+)
+
+
+class HistogramCollector(object):
+    """
+    Aggregates the count, total duration, total bytes and a cumulative
+    duration histogram of each phase and outcome:
+
+        collector = HistogramCollector()
+        collector.connect()
+        ...
+        collector.snapshot()['fetch']['ok']['count']
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != float('inf'):
+            self.buckets += (float('inf'),)
+        self._lock = threading.Lock()
+        self._receivers = {}
+        self.reset()
+
+    def connect(self):
+        for phase, signal in PHASES:
+            receiver = self._receivers.setdefault(
+                phase, self._make_receiver(phase))
+            signal.connect(receiver, weak=False)
+
+    def disconnect(self):
+        for phase, signal in PHASES:
+            if phase in self._receivers:
+                signal.disconnect(self._receivers[phase])
+
+    def _make_receiver(self, phase):
+        def receiver(sender, duration, bytes, outcome, **kwargs):
+            self.observe(phase, outcome, duration, bytes)
+        return receiver
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def observe(self, phase, outcome, duration, bytes=None):
+        with self._lock:
+            stats = self._stats.setdefault(phase, {}).get(outcome)
+            if stats is None:
+                stats = self._stats[phase][outcome] = {
+                    'count': 0, 'sum': 0.0, 'bytes': 0,
+                    'buckets': [0] * len(self.buckets)}
+            stats['count'] += 1
+            stats['sum'] += duration
+            if bytes:
+                stats['bytes'] += bytes
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    stats['buckets'][i] += 1
+
+    def snapshot(self):
+        """
+        Returns {phase: {outcome: {'count', 'sum', 'bytes', 'buckets'}}}
+        where buckets is a list of (upper bound, cumulative count).
+        """
+        with self._lock:
+            return dict(
+                (phase, dict(
+                    (outcome, {
+                        'count': stats['count'],
+                        'sum': stats['sum'],
+                        'bytes': stats['bytes'],
+                        'buckets': list(zip(self.buckets, stats['buckets'])),
+                    }) for outcome, stats in outcomes.items()))
+                for phase, outcomes in self._stats.items())
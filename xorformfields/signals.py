@@ -0,0 +1,51 @@
+"""
+Signals sent with the timing and outcome of the expensive phases of
+validating xorformfields fields.
+
+All of them are sent with `duration` (seconds), `bytes` (or None),
+`outcome` ('ok' or 'error') and `error` (the exception or None):
+
+    clean_finished: MutuallyExclusiveValueField.clean() or a row of
+        clean_many(), sent by the field class with `field`.
+    fetch_finished: downloading an URL, sent by the field class with `field`
+        and `url`.
+    storage_finished: saving a file to storage, sent by the storage class
+        with `storage`, `name` and `deferred`.
+"""
+import time
+
+from django.dispatch import Signal
+
+
+__all__ = ['clean_finished', 'fetch_finished', 'storage_finished', 'timed']
+
+clean_finished = Signal()
+fetch_finished = Signal()
+storage_finished = Signal()
+
+
+class timed(object):
+    """
+    Context manager timing its block and sending `signal` once it's over.
+    Set `bytes` on it to report a size. Costs next to nothing when the signal
+    has no receivers.
+    """
+    def __init__(self, signal, sender, **kwargs):
+        self.signal = signal
+        self.sender = sender
+        self.kwargs = kwargs
+        self.bytes = None
+
+    def __enter__(self):
+        self.active = self.signal.has_listeners(self.sender)
+        if self.active:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.active:
+            self.signal.send(
+                self.sender, duration=time.perf_counter() - self.start,
+                bytes=self.bytes, outcome='ok' if exc_type is None else 'error',
+                error=exc_value, **self.kwargs)
+        return False
@@ -0,0 +1,175 @@
+/*
+ * Sends the files selected in FileOrURLWidget(chunked=True) inputs to the
+ * chunked upload view, then submits the upload token instead of the file.
+ * Interrupted uploads resume where they stopped, including after a reload.
+ */
+(function () {
+    'use strict';
+
+    var RETRIES = 5;
+
+    function csrfToken(form) {
+        var input = form && form.querySelector('[name=csrfmiddlewaretoken]');
+        if (input) {
+            return input.value;
+        }
+        var match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+        return match ? decodeURIComponent(match[1]) : '';
+    }
+
+    function request(method, url, form, body, headers) {
+        return new Promise(function (resolve, reject) {
+            var xhr = new XMLHttpRequest();
+            xhr.open(method, url);
+            xhr.setRequestHeader('X-CSRFToken', csrfToken(form));
+            Object.keys(headers || {}).forEach(function (name) {
+                xhr.setRequestHeader(name, headers[name]);
+            });
+            xhr.onload = function () {
+                var data = {};
+                try {
+                    data = JSON.parse(xhr.responseText);
+                } catch (e) {}
+                resolve({status: xhr.status, data: data});
+            };
+            xhr.onerror = function () {
+                reject(new Error('network error'));
+            };
+            xhr.send(body);
+        });
+    }
+
+    function storageKey(input, file) {
+        return ['xorformfields', input.getAttribute('data-chunked-upload'),
+                file.name, file.size, file.lastModified].join(':');
+    }
+
+    function start(input, file) {
+        var base = input.getAttribute('data-chunked-upload');
+        var key = storageKey(input, file);
+        var token = window.localStorage && localStorage.getItem(key);
+        var resumed = token ?
+            request('GET', base + token + '/', input.form) :
+            Promise.resolve({status: 404});
+        return resumed.then(function (resp) {
+            if (resp.status === 200) {
+                return {token: token, offset: resp.data.offset};
+            }
+            var body = new FormData();
+            body.append('name', file.name);
+            body.append('size', file.size);
+            body.append('content_type', file.type);
+            return request('POST', base, input.form, body).then(function (resp) {
+                if (resp.status !== 201) {
+                    throw new Error(resp.data.error || 'upload refused');
+                }
+                if (window.localStorage) {
+                    localStorage.setItem(key, resp.data.token);
+                }
+                return {token: resp.data.token, offset: 0};
+            });
+        });
+    }
+
+    function send(input, file, upload, retries) {
+        var chunkSize = parseInt(input.getAttribute('data-chunk-size'), 10);
+        if (upload.offset >= file.size) {
+            return Promise.resolve(upload.token);
+        }
+        var end = Math.min(upload.offset + chunkSize, file.size);
+        var url = input.getAttribute('data-chunked-upload') + upload.token + '/';
+        return request('PUT', url, input.form, file.slice(upload.offset, end), {
+            'Content-Range': 'bytes ' + upload.offset + '-' + (end - 1) + '/' + file.size
+        }).then(function (resp) {
+            if (resp.status === 200 || resp.status === 409) {
+                upload.offset = resp.data.offset;
+                return send(input, file, upload, RETRIES);
+            }
+            throw new Error(resp.data.error || 'upload failed');
+        }, function (error) {
+            if (!retries) {
+                throw error;
+            }
+            return new Promise(function (resolve) {
+                setTimeout(resolve, (RETRIES - retries + 1) * 1000);
+            }).then(function () {
+                return request('GET', url, input.form);
+            }).then(function (resp) {
+                upload.offset = resp.data.offset;
+                return send(input, file, upload, retries - 1);
+            }, function () {
+                return send(input, file, upload, retries - 1);
+            });
+        });
+    }
+
+    function tokenInput(input) {
+        var name = input.getAttribute('data-token-name');
+        var hidden = input.form.querySelector('input[name="' + name + '"]');
+        if (!hidden) {
+            hidden = document.createElement('input');
+            hidden.type = 'hidden';
+            hidden.name = name;
+            input.parentNode.insertBefore(hidden, input.nextSibling);
+        }
+        return hidden;
+    }
+
+    function upload(input) {
+        var file = input.files[0];
+        var hidden = tokenInput(input);
+        hidden.value = '';
+        if (input.hasAttribute('data-name')) {
+            input.name = input.getAttribute('data-name');
+        }
+        input.xorUpload = null;
+        // files rejected by the size and type checks aren't sent at all
+        if (!file || !input.checkValidity()) {
+            return;
+        }
+        input.xorUpload = start(input, file).then(function (upload) {
+            return send(input, file, upload, RETRIES);
+        }).then(function (token) {
+            hidden.value = token;
+            // the file was already sent, don't submit it again
+            input.setAttribute('data-name', input.name);
+            input.removeAttribute('name');
+            if (window.localStorage) {
+                localStorage.removeItem(storageKey(input, file));
+            }
+        });
+        input.xorUpload.catch(function () {
+            // leave the file to be submitted with the form
+            input.xorUpload = null;
+        });
+    }
+
+    document.addEventListener('change', function (event) {
+        var input = event.target;
+        if (input.matches && input.matches('input[type=file][data-chunked-upload]')) {
+            // after the other change listeners, mutually_exclusive_widget.js
+            // sets the input's validity in one
+            setTimeout(function () {
+                upload(input);
+            }, 0);
+        }
+    });
+
+    document.addEventListener('submit', function (event) {
+        var form = event.target;
+        var pending = Array.prototype.filter.call(
+            form.querySelectorAll('input[type=file][data-chunked-upload]'),
+            function (input) { return input.xorUpload; }
+        ).map(function (input) {
+            return input.xorUpload.catch(function () {});
+        });
+        if (!pending.length || form.xorUploadsDone) {
+            return;
+        }
+        event.preventDefault();
+        Promise.all(pending).then(function () {
+            form.xorUploadsDone = true;
+            form.submit();
+        });
+    });
+}());
@@ -1,9 +1,121 @@
-$(document).ready(function () {
-    $('.mutually-exclusive-widget input[type=radio]').change(function () {
-        $(this).next().removeAttr('disabled');
-        $(this).parent().siblings().find('[name=' + $(this).attr('name') + ']').each(function () {
-                $(this).next().attr('disabled', '');
+/*
+ * Only the alternative selected by its radio button is enabled and
+ * submitted, and files are checked against the field's size and type limits
+ * before they are sent.
+ */
+(function () {
+    'use strict';
+
+    var WIDGET = '.mutually-exclusive-widget';
+
+    function radioOf(option) {
+        var first = option.firstElementChild;
+        return first && first.matches('input[type=radio]') ? first : null;
+    }
+
+    function options(widget) {
+        return Array.prototype.filter.call(widget.children, radioOf);
+    }
+
+    function controls(option) {
+        var radio = radioOf(option);
+        return Array.prototype.filter.call(
+            option.querySelectorAll('input, select, textarea, button'),
+            function (control) { return control !== radio; });
+    }
+
+    function update(widget) {
+        options(widget).forEach(function (option) {
+            var active = radioOf(option).checked;
+            controls(option).forEach(function (control) {
+                control.disabled = !active;
+            });
+        });
+    }
+
+    function inactiveControls(form) {
+        var inactive = [];
+        Array.prototype.forEach.call(form.querySelectorAll(WIDGET), function (widget) {
+            options(widget).forEach(function (option) {
+                if (!radioOf(option).checked) {
+                    inactive.push.apply(inactive, controls(option));
+                }
+            });
+        });
+        return inactive;
+    }
+
+    function accepts(accept, file) {
+        var name = file.name.toLowerCase();
+        var type = (file.type || 'application/octet-stream').toLowerCase();
+        return accept.split(',').some(function (pattern) {
+            pattern = pattern.trim().toLowerCase();
+            if (pattern.charAt(0) === '.') {
+                return name.slice(-pattern.length) === pattern;
+            }
+            if (pattern.slice(-2) === '/*') {
+                return type.indexOf(pattern.slice(0, -1)) === 0;
+            }
+            return pattern === type || pattern === '*/*';
+        });
+    }
+
+    function checkFile(input) {
+        var file = input.files && input.files[0];
+        var message = '';
+        var maxSize = input.getAttribute('data-max-size');
+        var accept = input.getAttribute('accept');
+        if (file && maxSize && file.size > parseInt(maxSize, 10)) {
+            message = input.getAttribute('data-max-size-error');
+        } else if (file && accept && !accepts(accept, file)) {
+            message = input.getAttribute('data-content-type-error');
+        }
+        input.setCustomValidity(message || '');
+        if (message) {
+            input.reportValidity();
+        }
+    }
+
+    function init(root) {
+        Array.prototype.forEach.call(root.querySelectorAll(WIDGET), update);
+    }
+
+    document.addEventListener('change', function (event) {
+        var target = event.target;
+        if (!target.matches) {
+            return;
+        }
+        if (target.matches(WIDGET + ' > * > input[type=radio]:first-child')) {
+            update(target.parentNode.parentNode);
+        } else if (target.matches('input[type=file][data-max-size], input[type=file][accept]')) {
+            checkFile(target);
+        }
+    });
+
+    // disabled controls aren't submitted, but files and values could still
+    // end up in a FormData built from the form by other scripts
+    document.addEventListener('formdata', function (event) {
+        inactiveControls(event.target).forEach(function (control) {
+            if (control.name) {
+                event.formData.delete(control.name);
+            }
         });
     });
-    $('.mutually-exclusive-widget input[type=radio]:checked').change();
-});
+
+    document.addEventListener('submit', function (event) {
+        inactiveControls(event.target).forEach(function (control) {
+            if (control.type === 'file') {
+                control.value = '';
+            }
+            control.disabled = true;
+        });
+    }, true);
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', function () {
+            init(document);
+        });
+    } else {
+        init(document);
+    }
+}());
@@ -14,3 +14,5 @@ DATABASES = {
 MIDDLEWARE_CLASSES = []
 
 INSTALLED_APPS = ['xorformfields']
+
+ROOT_URLCONF = 'xorformfields.test_urls'
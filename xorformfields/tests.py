@@ -1,29 +1,56 @@
-from __future__ import absolute_import, unicode_literals
-
-try:
-    from io import StringIO
-except ImportError:
-    from StringIO import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
 import tempfile
 import shutil
-try:
-    from urllib.parse import urljoin
-except ImportError:
-    from urlparse import urljoin
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urljoin
 
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 from django import forms
 from django.forms import widgets
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadedfile import (
+    InMemoryUploadedFile, SimpleUploadedFile, TemporaryUploadedFile,
+    UploadedFile)
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.conf import settings
+from django.test.utils import override_settings
 from django import VERSION
 
 from mock import patch
+import httpx
 
 from xorformfields.forms import (
     FileOrURLField, MutuallyExclusiveRadioWidget,
     MutuallyExclusiveValueField, FileOrURLWidget,
     )
+from xorformfields.forms import (
+    KeyedExclusiveValueField, KeyedExclusiveRadioWidget, ExclusiveChoice,
+    PrefetchURLsMixin, PrefetchURLsFormSetMixin, SpooledUploadedFile,
+    LazyRemoteFile, CallbackProcessor, HashProcessor, SizeLimitProcessor,
+    SniffProcessor, fetch)
+from xorformfields.forms.aio import AsyncFormMixin
+from xorformfields.forms.files import sniff_content_type
+from xorformfields.forms.cache import DiskDownloadCache, DjangoDownloadCache
+from xorformfields.forms.ratelimit import CacheRateLimiter, RateLimiter
+from xorformfields.forms.resolver import Resolver, get_resolver
+from xorformfields.forms.storage import (
+    DeferredSaveError, ImmediateExecutor, PendingURL, StoredURL)
+from xorformfields.forms.uploads import (
+    ChunkedUploadStore, UploadError, UploadOffsetError, get_upload_store)
+from xorformfields.forms.widgets import RadioInput, render_radio
+from xorformfields.metrics import HistogramCollector
+from xorformfields.signals import fetch_finished
 
 djversion = float('.'.join(map(str, VERSION[:2])))
 
@@ -103,6 +130,250 @@ class MutuallyExclusiveValueFieldInferedWidgetsTestCase(
             '</select></span></span>')
 
 
+class ShortCircuitMutuallyExclusiveValueFieldTestCase(
+        MutuallyExclusiveValueFieldTestCase):
+    def setUp(self):
+        self.cleaned = []
+        cleaned = self.cleaned
+
+        class CountingIntegerField(forms.IntegerField):
+            def clean(self, value):
+                cleaned.append(value)
+                return super(CountingIntegerField, self).clean(value)
+
+        class TestForm(forms.Form):
+            test_field = MutuallyExclusiveValueField(
+                fields=[CountingIntegerField() for _ in range(4)],
+                short_circuit=True)
+        self.form = TestForm
+
+    def test_only_nonempty_cleaned(self):
+        form = self.form({'test_field_2': '7'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['test_field'], 7)
+        self.assertEqual(self.cleaned, ['7'])
+
+    def test_too_many_before_cleaning(self):
+        form = self.form({'test_field_0': 'error', 'test_field_3': '1'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors,
+                         {'test_field':
+                          [MutuallyExclusiveValueField.too_many_values_error]})
+        self.assertEqual(self.cleaned, [])
+
+    def test_bad_value_errors(self):
+        form = self.form({'test_field_1': 'error'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors,
+                         {'test_field':
+                          [forms.IntegerField.default_error_messages[
+                              'invalid']]})
+
+
+class CleanManyTestCase(TestCase):
+    def setUp(self):
+        self.cleaned = []
+        cleaned = self.cleaned
+
+        class CountingIntegerField(forms.IntegerField):
+            def clean(self, value):
+                cleaned.append(value)
+                return super(CountingIntegerField, self).clean(value)
+        self.field = MutuallyExclusiveValueField(
+            fields=[CountingIntegerField(), CountingIntegerField()])
+
+    def test_clean_many(self):
+        results = self.field.clean_many([
+            ['1', ''],
+            ['', '2'],
+            ['3', '4'],
+            ['', ''],
+            ['error', ''],
+            'invalid',
+            [None, '5'],
+        ])
+        self.assertEqual([value for value, _ in results],
+                         [1, 2, None, None, None, None, 5])
+        self.assertEqual(
+            [error and error.messages for _, error in results],
+            [None, None,
+             [MutuallyExclusiveValueField.too_many_values_error],
+             [forms.Field.default_error_messages['required']],
+             [forms.IntegerField.default_error_messages['invalid']],
+             [forms.MultiValueField.default_error_messages['invalid']],
+             None])
+        self.assertEqual(self.cleaned, ['1', '2', 'error', '5'])
+
+    def test_optional(self):
+        self.field.required = False
+        self.assertEqual(self.field.clean_many([['', ''], []]),
+                         [(None, None), (None, None)])
+        self.assertEqual(self.cleaned, [])
+
+
+class KeyedExclusiveValueFieldTestCase(TestCase):
+    def setUp(self):
+        self.read = []
+        read = self.read
+
+        class TrackingTextInput(forms.TextInput):
+            def value_from_datadict(self, data, files, name):
+                read.append(name)
+                return super(TrackingTextInput, self).value_from_datadict(
+                    data, files, name)
+
+        class TestForm(forms.Form):
+            test_field = KeyedExclusiveValueField(fields=[
+                ('isbn', forms.CharField(max_length=13,
+                                         widget=TrackingTextInput)),
+                ('doi', forms.CharField(widget=TrackingTextInput)),
+                ('number', forms.IntegerField(widget=TrackingTextInput)),
+            ])
+        self.form = TestForm
+
+    def test_selected(self):
+        form = self.form({'test_field_radio': 'number',
+                          'test_field_isbn': 'stale',
+                          'test_field_number': '42'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['test_field'],
+                         ExclusiveChoice('number', 42))
+        self.assertEqual(self.read, ['test_field_number'])
+
+    def test_selected_empty(self):
+        form = self.form({'test_field_radio': 'doi',
+                          'test_field_isbn': '123'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors,
+                         {'test_field':
+                          [forms.Field.default_error_messages['required']]})
+
+    def test_selected_invalid(self):
+        form = self.form({'test_field_radio': 'number',
+                          'test_field_number': 'x'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors,
+                         {'test_field':
+                          [forms.IntegerField.default_error_messages[
+                              'invalid']]})
+
+    def test_without_radio(self):
+        form = self.form({'test_field_doi': '10.1000/1'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['test_field'],
+                         ExclusiveChoice('doi', '10.1000/1'))
+        form = self.form({'test_field_doi': '10.1000/1',
+                          'test_field_isbn': '123'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors,
+                         {'test_field':
+                          [MutuallyExclusiveValueField.too_many_values_error]})
+
+    def test_unknown_radio(self):
+        form = self.form({'test_field_radio': 'nope',
+                          'test_field_doi': '10.1000/1'})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['test_field'].key, 'doi')
+
+    def test_clean(self):
+        field = self.form().fields['test_field']
+        self.assertEqual(field.clean(ExclusiveChoice('number', '1')),
+                         ExclusiveChoice('number', 1))
+        self.assertEqual(field.clean(['', '', '7']),
+                         ExclusiveChoice('number', 7))
+        self.assertRaises(forms.ValidationError, field.clean, {'x': '1'})
+        self.assertEqual(
+            [error and error.messages for _, error in field.clean_many(
+                [{'isbn': '1'}, {'isbn': '1', 'doi': '2'}])],
+            [None, [MutuallyExclusiveValueField.too_many_values_error]])
+
+    def test_render(self):
+        form = self.form({'test_field_radio': 'doi',
+                          'test_field_doi': '10.1000/1'})
+        self.assertHTMLEqual(
+            str(form['test_field']),
+            '<span id="test_field_container" '
+            'class="mutually-exclusive-widget" style="display:inline-block">'
+            '<span><input name="test_field_radio" type="radio" value="isbn">'
+            '<input id="id_test_field_0" maxlength="13" '
+            'name="test_field_isbn" type="text"></span><br>'
+            '<span><input checked name="test_field_radio" type="radio" '
+            'value="doi"><input id="id_test_field_1" '
+            'name="test_field_doi" type="text" value="10.1000/1"></span><br>'
+            '<span><input name="test_field_radio" type="radio" '
+            'value="number"><input id="id_test_field_2" '
+            'name="test_field_number" type="text"></span></span>')
+
+    def test_has_changed(self):
+        form = self.form({'test_field_radio': 'doi'})
+        self.assertFalse(form.has_changed())
+        form = self.form({'test_field_radio': 'doi',
+                          'test_field_doi': '10.1000/1'})
+        self.assertTrue(form.has_changed())
+
+    def test_widget(self):
+        widget = KeyedExclusiveRadioWidget(
+            [('isbn', forms.TextInput()), ('doi', forms.TextInput())])
+        self.assertEqual(widget.keys, ['isbn', 'doi'])
+        self.assertEqual(widget.decompress(ExclusiveChoice('doi', 'x')),
+                         [None, 'x'])
+        self.assertEqual(widget.decompress({'isbn': '1'}), ['1', None])
+        self.assertEqual(widget.value_from_datadict(
+            {'t_radio': 'doi', 't_isbn': '1', 't_doi': '2'}, {}, 't'),
+            {'doi': '2'})
+        self.assertEqual(widget.value_from_datadict(
+            {'t_isbn': '1', 't_doi': ''}, {}, 't'), {'isbn': '1'})
+        html = widget.render('t', {'doi': '2'})
+        self.assertInHTML('<input checked name="t_radio" type="radio" '
+                          'value="doi">', html)
+        self.assertInHTML('<input name="t_doi" type="text" value="2">', html)
+
+
+class CopyTestCase(TestCase):
+    def setUp(self):
+        copies = self.copies = []
+
+        class CustomCopyField(forms.IntegerField):
+            def __deepcopy__(self, memo):
+                copies.append(self)
+                return super(CustomCopyField, self).__deepcopy__(memo)
+
+        class TestForm(forms.Form):
+            test_field = MutuallyExclusiveValueField(fields=[
+                forms.ChoiceField(choices=[(1, 1), (2, 2)]),
+                CustomCopyField()])
+            file_field = FileOrURLField(widget=FileOrURLWidget())
+        self.form = TestForm
+
+    def test_independent_copies(self):
+        first, second = self.form(), self.form()
+        field, other = first.fields['test_field'], second.fields['test_field']
+        self.assertIsNot(field, other)
+        for a, b in zip(field.fields, other.fields):
+            self.assertIsNot(a, b)
+            self.assertIsNot(a.widget, b.widget)
+        for a, b in zip(field.widget.widgets, other.widget.widgets):
+            self.assertIsNot(a, b)
+            self.assertIsNot(a.attrs, b.attrs)
+        self.assertIsNot(first.fields['file_field']._prefetched,
+                         second.fields['file_field']._prefetched)
+
+        field.fields[0].choices = [(3, 3)]
+        field.widget.widgets[0].choices = [(3, 3)]
+        field.widget.widgets[1].attrs['class'] = 'changed'
+        field.error_messages['invalid'] = 'changed'
+        self.assertEqual(list(other.fields[0].choices), [(1, 1), (2, 2)])
+        self.assertEqual(list(other.widget.widgets[0].choices),
+                         [(1, 1), (2, 2)])
+        self.assertNotIn('class', other.widget.widgets[1].attrs)
+        self.assertNotEqual(other.error_messages['invalid'], 'changed')
+        self.assertIn('value="2"', second.as_p())
+
+    def test_custom_deepcopy_used(self):
+        self.form()
+        self.assertEqual(len(self.copies), 1)
+
+
 class LocalizedMutuallyExclusiveValueFieldTestCase(TestCase):
     def test_first_values(self):
         w = FileOrURLWidget()
@@ -220,9 +491,29 @@ class FileOrURLToURLTestCase(FileOrURLTestZeroOrTwoValsMixin,
             urljoin(settings.MEDIA_URL, 'TEST/file'))
 
 
+class MockResp(object):
+    status_code = 200
+
+    def __init__(self, content=b'', headers=None, status_code=None):
+        self.content = content
+        self.headers = {'content-type': 'text/plain'}
+        if headers is not None:
+            self.headers.update(headers)
+        if status_code is not None:
+            self.status_code = status_code
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
 class FileOrURLToFileTestCase(FileOrURLTestZeroOrTwoValsMixin,
                               FileOrURLTestCaseBase):
-    test_resp = 'foobar'
+    test_resp = b'foobar'
 
     def setUp(self):
         class TestForm(forms.Form):
@@ -236,30 +527,35 @@ class FileOrURLToFileTestCase(FileOrURLTestZeroOrTwoValsMixin,
         self.assertTrue(form.is_valid())
         self.assertEqual(form.cleaned_data['test_field'], self.test_file)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_validate_url(self, mock_get):
-        class MockResp(object):
-            status_code = 200
-            content = self.test_resp
-            headers = {'content-type': 'text/plain'}
-        mock_get.return_value = MockResp()
+        mock_get.return_value = MockResp(self.test_resp)
         form = self.form({'test_field_1': 'http://example.com'}, {})
         self.assertTrue(form.is_valid())
         self.assertEqual(
             form.cleaned_data['test_field'].read(),
             self.test_resp)
+        self.assertEqual(form.cleaned_data['test_field'].size,
+                         len(self.test_resp))
+        self.assertTrue(mock_get.call_args[1]['stream'])
+        self.assertTrue(mock_get.return_value.closed)
+
+    @patch('requests.Session.get')
+    def test_validate_binary_url(self, mock_get):
+        content = bytes(bytearray(range(256)))
+        mock_get.return_value = MockResp(
+            content, {'content-type': 'application/octet-stream'})
+        form = self.form({'test_field_1': 'http://example.com'}, {})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['test_field'].read(), content)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_validate_bad_url(self, mock_get):
-        class MockResp(object):
-            status_code = 400
-            content = self.test_resp
-            headers = {'content-type': 'text/plain'}
-        mock_get.return_value = MockResp()
+        mock_get.return_value = MockResp(self.test_resp, status_code=400)
         form = self.form({'test_field_1': 'http://example.com'}, {})
         self.assertFalse(form.is_valid())
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_validate_bad_request(self, mock_get):
         def raise_exception():
             raise Exception
@@ -268,6 +564,1274 @@ class FileOrURLToFileTestCase(FileOrURLTestZeroOrTwoValsMixin,
         self.assertFalse(form.is_valid())
 
 
+class FileOrURLToFileLimitsTestCase(FileOrURLTestCaseBase):
+    def setUp(self):
+        class TestForm(forms.Form):
+            test_field = FileOrURLField(to='file', max_size=10,
+                                        max_memory_size=4)
+        self.form = TestForm
+
+    @patch('requests.Session.get')
+    def test_spools_to_disk(self, mock_get):
+        mock_get.return_value = MockResp(b'0123456789')
+        form = self.form({'test_field_1': 'http://example.com'}, {})
+        self.assertTrue(form.is_valid())
+        uploaded = form.cleaned_data['test_field']
+        self.assertIsInstance(uploaded, SpooledUploadedFile)
+        self.assertFalse(uploaded.in_memory)
+        self.assertEqual(uploaded.size, 10)
+        self.assertEqual(uploaded.read(), b'0123456789')
+        uploaded.close()
+
+    @patch('requests.Session.get')
+    def test_too_large_streamed(self, mock_get):
+        mock_get.return_value = MockResp(b'0123456789A')
+        form = self.form({'test_field_1': 'http://example.com'}, {})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors,
+                         {'test_field': [FileOrURLField.url_too_large_error]})
+
+    @patch('requests.Session.get')
+    def test_too_large_content_length(self, mock_get):
+        resp = MockResp(b'', {'content-length': '11'})
+        resp.iter_content = None  # the body must never be read
+        mock_get.return_value = resp
+        form = self.form({'test_field_1': 'http://example.com'}, {})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors,
+                         {'test_field': [FileOrURLField.url_too_large_error]})
+        self.assertTrue(resp.closed)
+
+
+class FileOrURLContentTypeTestCase(FileOrURLTestCaseBase):
+    def setUp(self):
+        class TestForm(forms.Form):
+            test_field = FileOrURLField(
+                to='file', max_size=10, probe=True,
+                allowed_content_types=['image/*', 'application/pdf'])
+        self.form = TestForm
+
+    def clean(self):
+        form = self.form({'test_field_1': 'http://example.com/a'}, {})
+        form.is_valid()
+        return form
+
+    def test_content_type_allowed(self):
+        allowed = ['image/*', 'application/pdf']
+        self.assertTrue(fetch.content_type_allowed('image/png', allowed))
+        self.assertTrue(fetch.content_type_allowed(
+            'Application/PDF; charset=binary', allowed))
+        self.assertFalse(fetch.content_type_allowed('text/html', allowed))
+        self.assertFalse(fetch.content_type_allowed(None, allowed))
+        self.assertTrue(fetch.content_type_allowed('text/html', None))
+
+    @patch('requests.Session.head')
+    @patch('requests.Session.get')
+    def test_rejected_by_probe(self, mock_get, mock_head):
+        mock_head.return_value = MockResp(headers={'content-type': 'text/html'})
+        form = self.clean()
+        self.assertEqual(form.errors, {
+            'test_field': [FileOrURLField.url_content_type_error]})
+        self.assertFalse(mock_get.called)
+
+    @patch('requests.Session.head')
+    @patch('requests.Session.get')
+    def test_too_large_by_probe(self, mock_get, mock_head):
+        mock_head.return_value = MockResp(headers={
+            'content-type': 'image/png', 'content-length': '11'})
+        form = self.clean()
+        self.assertEqual(form.errors,
+                         {'test_field': [FileOrURLField.url_too_large_error]})
+        self.assertFalse(mock_get.called)
+
+    @patch('requests.Session.head')
+    @patch('requests.Session.get')
+    def test_failed_probe_falls_back_to_get(self, mock_get, mock_head):
+        mock_head.return_value = MockResp(status_code=403)
+        resp = mock_get.return_value = MockResp(
+            b'', {'content-type': 'text/html'})
+        resp.iter_content = None  # the body must never be read
+        form = self.clean()
+        self.assertEqual(form.errors, {
+            'test_field': [FileOrURLField.url_content_type_error]})
+        self.assertTrue(resp.closed)
+
+    @patch('requests.Session.head')
+    @patch('requests.Session.get')
+    def test_allowed(self, mock_get, mock_head):
+        mock_head.return_value = MockResp(headers={'content-type': 'image/png'})
+        mock_get.return_value = MockResp(
+            b'\x89PNG\r\n\x1a\n', {'content-type': 'image/png'})
+        form = self.clean()
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['test_field'].content_type,
+                         'image/png')
+
+    @patch('requests.Session.head')
+    @patch('requests.Session.get')
+    def test_sniffed_type_checked(self, mock_get, mock_head):
+        mock_head.return_value = MockResp(headers={'content-type': 'image/png'})
+        mock_get.return_value = MockResp(
+            b'PK\x03\x04zip', {'content-type': 'image/png'})
+        form = self.clean()
+        self.assertEqual(form.errors, {
+            'test_field': [FileOrURLField.url_content_type_error]})
+
+    @patch('requests.Session.get')
+    def test_missing_content_type(self, mock_get):
+        resp = MockResp(b'foo')
+        del resp.headers['content-type']
+        mock_get.return_value = resp
+        uploaded = fetch.download('http://example.com/a')
+        self.assertEqual(uploaded.content_type, 'application/octet-stream')
+        self.assertEqual(uploaded.read(), b'foo')
+
+
+class LazyFileOrURLTestCase(TestCase):
+    def setUp(self):
+        class TestForm(PrefetchURLsMixin, forms.Form):
+            test_field = FileOrURLField(to='file', lazy=True)
+            other_field = FileOrURLField(to='file', lazy=True,
+                                         required=False)
+            number = forms.IntegerField()
+        self.form = TestForm
+
+    @patch('requests.Session.get')
+    def test_downloads_on_first_access(self, mock_get):
+        mock_get.return_value = MockResp(b'foobar')
+        form = self.form({'test_field_1': 'http://example.com/a.txt',
+                          'other_field_1': 'http://example.com/b.txt',
+                          'number': '1'})
+        self.assertTrue(form.is_valid())
+        lazy = form.cleaned_data['test_field']
+        self.assertIsInstance(lazy, LazyRemoteFile)
+        self.assertEqual(lazy.name, 'a.txt')
+        self.assertFalse(mock_get.called)
+        self.assertFalse(lazy.loaded)
+        self.assertEqual(lazy.size, 6)
+        self.assertEqual(lazy.read(), b'foobar')
+        self.assertEqual(b''.join(lazy.chunks()), b'foobar')
+        self.assertEqual(lazy.content_type, 'text/plain')
+        self.assertEqual(mock_get.call_count, 1)
+        lazy.close()
+        self.assertTrue(lazy.closed)
+
+    @patch('requests.Session.get')
+    def test_invalid_form_doesnt_download(self, mock_get):
+        form = self.form({'test_field_1': 'http://example.com/a.txt',
+                          'number': 'x'})
+        self.assertFalse(form.is_valid())
+        self.assertFalse(mock_get.called)
+        form.cleaned_data['test_field'].close()
+
+    @patch('requests.Session.get')
+    def test_download_error(self, mock_get):
+        mock_get.return_value = MockResp(status_code=404)
+        field = FileOrURLField(to='file', lazy=True)
+        lazy = field.clean(['', 'http://example.com/a.txt'])
+        with self.assertRaises(forms.ValidationError) as cm:
+            lazy.read()
+        self.assertEqual(cm.exception.messages,
+                         [FileOrURLField.url_fetch_error])
+
+
+class SpooledUploadedFileTestCase(TestCase):
+    png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 8
+
+    def spooled(self, chunks, **kwargs):
+        f = SpooledUploadedFile('file', 'text/plain', **kwargs)
+        for chunk in chunks:
+            f.write(chunk)
+        f.seek(0)
+        self.addCleanup(f.close)
+        return f
+
+    def test_size_and_content_type(self):
+        f = self.spooled([self.png, 'é'.encode('utf-8')])
+        self.assertEqual(f.size, 18)
+        self.assertEqual(f.content_type, 'image/png')
+        self.assertEqual(f.declared_content_type, 'text/plain')
+        self.assertEqual(f.read(), self.png + b'\xc3\xa9')
+
+    def test_sniff_small_writes(self):
+        webp = b'RIFF\0\0\0\0WEBPVP8 '
+        f = self.spooled([webp[i:i + 3] for i in range(0, len(webp), 3)])
+        self.assertEqual(f.content_type, 'image/webp')
+        self.assertEqual(f.read(), webp)
+
+    def test_declared_content_type(self):
+        f = self.spooled([b'foobar'])
+        self.assertEqual(f.content_type, 'text/plain')
+        f = SpooledUploadedFile('file')
+        self.assertEqual(f.content_type, 'application/octet-stream')
+
+    def test_in_memory(self):
+        f = self.spooled([b'foo', b'bar'], max_memory_size=10)
+        self.assertTrue(f.in_memory)
+        self.assertEqual(bytes(f.getbuffer()), b'foobar')
+        buf = bytearray(4)
+        self.assertEqual(f.readinto(buf), 4)
+        self.assertEqual(buf, b'foob')
+
+    def test_on_disk(self):
+        f = self.spooled([b'foo', b'bar'], max_memory_size=4)
+        self.assertFalse(f.in_memory)
+        self.assertEqual(bytes(f.getbuffer()), b'foobar')
+        self.assertEqual(b''.join(f.chunks(4)), b'foobar')
+        f.seek(1)
+        buf = bytearray(4)
+        self.assertEqual(f.readinto(buf), 4)
+        self.assertEqual(buf, b'ooba')
+
+    def test_sniff(self):
+        self.assertEqual(sniff_content_type(b'GIF89a...'), 'image/gif')
+        self.assertEqual(sniff_content_type(b'RIFF\0\0\0\0WEBPVP8 '),
+                         'image/webp')
+        self.assertIsNone(sniff_content_type(b'xxxx\0\0\0\0WEBP'))
+        self.assertIsNone(sniff_content_type(b''))
+
+
+class FetchSessionTestCase(TestCase):
+    def tearDown(self):
+        fetch.set_session(None)
+
+    def test_session_is_shared(self):
+        self.assertIs(fetch.get_session(), fetch.get_session())
+
+    @override_settings(XORFORMFIELDS_HTTP={
+        'POOL_MAXSIZE': 42, 'RETRIES': 5, 'BACKOFF_FACTOR': 1})
+    def test_session_from_settings(self):
+        adapter = fetch.get_session().get_adapter('https://example.com/')
+        self.assertEqual(adapter._pool_maxsize, 42)
+        self.assertEqual(adapter.max_retries.total, 5)
+        self.assertEqual(adapter.max_retries.backoff_factor, 1)
+
+    def test_settings_change_resets_session(self):
+        session = fetch.get_session()
+        with override_settings(XORFORMFIELDS_HTTP={'RETRIES': 0}):
+            self.assertIsNot(fetch.get_session(), session)
+
+    @override_settings(XORFORMFIELDS_HTTP={'TIMEOUT': 7})
+    @patch('requests.Session.get')
+    def test_default_timeout(self, mock_get):
+        mock_get.return_value = MockResp(b'foobar')
+        fetch.download('http://example.com')
+        self.assertEqual(mock_get.call_args[1]['timeout'], 7)
+
+    def test_field_session(self):
+        class MockSession(object):
+            def get(self, url, **kwargs):
+                self.kwargs = kwargs
+                return MockResp(b'foobar')
+        session = MockSession()
+
+        class TestForm(forms.Form):
+            test_field = FileOrURLField(to='file', session=session,
+                                        timeout=1)
+        form = TestForm({'test_field_1': 'http://example.com'}, {})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['test_field'].read(), b'foobar')
+        self.assertEqual(session.kwargs['timeout'], 1)
+
+
+class AsyncFileOrURLTestCase(TestCase):
+    def setUp(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        async def handler(request):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(0.01)
+            self.in_flight -= 1
+            if request.url.path == '/missing':
+                return httpx.Response(404)
+            if request.url.path == '/redirect':
+                return httpx.Response(302, headers={
+                    'location': request.url.params['to']})
+            return httpx.Response(200, content=request.url.path.encode(),
+                                  headers={'content-type': 'text/plain'})
+        self.client = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler), follow_redirects=True)
+        self.stub = StubResolver({'example.com': ['93.184.216.34'],
+                                  'internal.test': ['10.0.0.5']})
+        settings = override_settings(XORFORMFIELDS_RESOLVER={
+            'OPTIONS': {'getaddrinfo': self.stub}})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        class TestForm(AsyncFormMixin, forms.Form):
+            first = FileOrURLField(to='file', async_client=self.client)
+            second = FileOrURLField(to='file', async_client=self.client)
+        self.form = TestForm
+
+    def test_aclean(self):
+        field = FileOrURLField(to='file', async_client=self.client)
+        result = asyncio.run(field.aclean(['', 'http://example.com/a']))
+        self.assertEqual(result.read(), b'/a')
+
+    def test_aclean_bad_url(self):
+        field = FileOrURLField(to='file', async_client=self.client)
+        with self.assertRaises(forms.ValidationError):
+            asyncio.run(field.aclean(['', 'http://example.com/missing']))
+
+    def test_ato_python(self):
+        field = FileOrURLField(to='file', async_client=self.client)
+        result = asyncio.run(field.ato_python('http://example.com/b'))
+        self.assertEqual(result.read(), b'/b')
+
+    def test_aclean_content_type_probe(self):
+        methods = []
+
+        async def handler(request):
+            methods.append(request.method)
+            return httpx.Response(200, headers={'content-type': 'text/html'})
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        field = FileOrURLField(to='file', async_client=client, probe=True,
+                               allowed_content_types=['image/*'])
+        with self.assertRaises(forms.ValidationError) as cm:
+            asyncio.run(field.aclean(['', 'http://example.com/a']))
+        self.assertEqual(cm.exception.messages,
+                         [FileOrURLField.url_content_type_error])
+        self.assertEqual(methods, ['HEAD'])
+
+    def test_client_addresses_checked(self):
+        field = FileOrURLField(to='file', async_client=self.client)
+        for url in ('http://internal.test/a', 'http://10.0.0.5/a',
+                    'http://example.com/redirect?to=http://internal.test/a'):
+            with self.assertRaises(forms.ValidationError) as cm:
+                asyncio.run(field.aclean(['', url]))
+            self.assertEqual(cm.exception.messages,
+                             [FileOrURLField.url_address_error])
+        result = asyncio.run(field.aclean(
+            ['', 'http://example.com/redirect?to=http://example.com/b']))
+        self.assertEqual(result.read(), b'/b')
+
+    @patch('requests.Session.get')
+    def test_ais_valid_concurrent(self, mock_get):
+        form = self.form({'first_1': 'http://example.com/1',
+                          'second_1': 'http://example.com/2'})
+        self.assertTrue(asyncio.run(form.ais_valid()))
+        self.assertEqual(form.cleaned_data['first'].read(), b'/1')
+        self.assertEqual(form.cleaned_data['second'].read(), b'/2')
+        self.assertEqual(self.max_in_flight, 2)
+        self.assertFalse(mock_get.called)
+
+    def test_ais_valid_errors(self):
+        form = self.form({'first_1': 'http://example.com/missing',
+                          'second_1': 'not a url'})
+        self.assertFalse(asyncio.run(form.ais_valid()))
+        self.assertEqual(form.errors['first'],
+                         [FileOrURLField.url_fetch_error])
+        self.assertIn('second', form.errors)
+
+
+class PrefetchURLsTestCase(TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        def get(url, **kwargs):
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(0.02)
+            with self.lock:
+                self.in_flight -= 1
+            if url.endswith('missing'):
+                return MockResp(status_code=404)
+            return MockResp(url.encode())
+        patcher = patch('requests.Session.get', side_effect=get)
+        self.mock_get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_form(self):
+        class TestForm(PrefetchURLsMixin, forms.Form):
+            first = FileOrURLField(to='file')
+            second = FileOrURLField(to='file')
+            third = FileOrURLField(to='file')
+        form = TestForm({'first_1': 'http://example.com/1',
+                         'second_1': 'http://example.com/missing',
+                         'third_1': 'not a url'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.cleaned_data['first'].read(),
+                         b'http://example.com/1')
+        self.assertEqual(form.errors['second'],
+                         [FileOrURLField.url_fetch_error])
+        self.assertIn('third', form.errors)
+        self.assertEqual(self.mock_get.call_count, 2)
+        self.assertEqual(self.max_in_flight, 2)
+
+    def test_formset(self):
+        class TestForm(forms.Form):
+            test_field = FileOrURLField(to='file')
+
+        class BaseFormSet(PrefetchURLsFormSetMixin, forms.BaseFormSet):
+            prefetch_max_workers = 3
+        FormSet = forms.formset_factory(TestForm, formset=BaseFormSet,
+                                        extra=0)
+        data = {'form-TOTAL_FORMS': '6', 'form-INITIAL_FORMS': '0'}
+        for i in range(6):
+            data['form-%d-test_field_1' % i] = 'http://example.com/%d' % i
+        formset = FormSet(data)
+        self.assertTrue(formset.is_valid())
+        self.assertEqual(
+            [form.cleaned_data['test_field'].read() for form in formset],
+            [('http://example.com/%d' % i).encode() for i in range(6)])
+        self.assertEqual(self.mock_get.call_count, 6)
+        self.assertEqual(self.max_in_flight, 3)
+
+
+class DownloadCacheTestCase(TestCase):
+    url = 'http://example.com/image.png'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.cache = DiskDownloadCache(self.directory, max_size=10)
+        patcher = patch('requests.Session.get')
+        self.mock_get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def download(self, url=None, cache=None):
+        return fetch.download(url or self.url, cache=cache or self.cache)
+
+    def test_fresh_hit(self):
+        self.mock_get.return_value = MockResp(
+            b'foobar', {'cache-control': 'max-age=60'})
+        self.assertEqual(self.download().read(), b'foobar')
+        cached = self.download()
+        self.assertEqual(cached.read(), b'foobar')
+        self.assertEqual(cached.size, 6)
+        self.assertEqual(cached.content_type, 'text/plain')
+        self.assertEqual(self.mock_get.call_count, 1)
+        cached.close()
+
+    def test_revalidate(self):
+        self.mock_get.return_value = MockResp(
+            b'foobar', {'cache-control': 'no-cache', 'etag': '"v1"'})
+        self.download().close()
+        self.mock_get.return_value = MockResp(
+            b'', {'etag': '"v1"'}, status_code=304)
+        cached = self.download()
+        self.assertEqual(cached.read(), b'foobar')
+        self.assertEqual(self.mock_get.call_args[1]['headers'],
+                         {'If-None-Match': '"v1"'})
+        cached.close()
+
+    def test_changed(self):
+        self.mock_get.return_value = MockResp(
+            b'foobar', {'last-modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        self.download().close()
+        self.mock_get.return_value = MockResp(b'bazqux')
+        self.assertEqual(self.download().read(), b'bazqux')
+        self.assertEqual(
+            self.mock_get.call_args[1]['headers'],
+            {'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+
+    def test_no_store(self):
+        self.mock_get.return_value = MockResp(
+            b'foobar', {'cache-control': 'no-store, max-age=60'})
+        self.download()
+        self.download()
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_private(self):
+        for headers in ({'cache-control': 'private, max-age=60'},
+                        {'cache-control': 'max-age=60', 'vary': 'Accept, *'}):
+            self.mock_get.reset_mock()
+            self.mock_get.return_value = MockResp(b'foobar', headers)
+            self.download().close()
+            self.download().close()
+            self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_content_addressed(self):
+        self.mock_get.return_value = MockResp(
+            b'foobar', {'cache-control': 'max-age=60'})
+        self.download('http://example.com/a').close()
+        self.download('http://example.com/b').close()
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.directory, 'objects'))), 1)
+
+    def test_lru_eviction(self):
+        for i, body in enumerate([b'aaaa', b'bbbb', b'cccc']):
+            self.mock_get.return_value = MockResp(
+                body, {'cache-control': 'max-age=60'})
+            self.download('http://example.com/%d' % i).close()
+            time.sleep(0.01)
+        self.assertEqual(
+            len(os.listdir(os.path.join(self.directory, 'objects'))), 2)
+        self.assertEqual(self.download('http://example.com/2').read(),
+                         b'cccc')
+        self.assertEqual(self.mock_get.call_count, 3)
+        self.mock_get.return_value = MockResp(b'aaaa')
+        self.assertEqual(self.download('http://example.com/0').read(),
+                         b'aaaa')
+        self.assertEqual(self.mock_get.call_count, 4)
+
+    def test_max_size(self):
+        self.mock_get.return_value = MockResp(
+            b'foobar', {'cache-control': 'max-age=60'})
+        self.download().close()
+        with self.assertRaises(fetch.FetchTooLarge):
+            fetch.download(self.url, max_size=5, cache=self.cache)
+
+    def test_django_cache(self):
+        cache = DjangoDownloadCache(max_entry_size=10)
+        self.mock_get.return_value = MockResp(
+            b'foobar', {'cache-control': 'max-age=60'})
+        self.download(cache=cache)
+        self.assertEqual(self.download(cache=cache).read(), b'foobar')
+        self.assertEqual(self.mock_get.call_count, 1)
+        self.mock_get.return_value = MockResp(
+            b'0123456789A', {'cache-control': 'max-age=60'})
+        self.download('http://example.com/big', cache=cache)
+        self.download('http://example.com/big', cache=cache)
+        self.assertEqual(self.mock_get.call_count, 3)
+
+    def test_field_from_settings(self):
+        self.mock_get.return_value = MockResp(
+            b'foobar', {'cache-control': 'max-age=60'})
+        with override_settings(XORFORMFIELDS_DOWNLOAD_CACHE={
+                'BACKEND': 'xorformfields.forms.cache.DiskDownloadCache',
+                'OPTIONS': {'directory': self.directory}}):
+            for _ in range(2):
+                field = FileOrURLField(to='file')
+                self.assertEqual(field.clean(['', self.url]).read(),
+                                 b'foobar')
+            self.assertEqual(self.mock_get.call_count, 1)
+            field = FileOrURLField(to='file', cache=False)
+            field.clean(['', self.url])
+            self.assertEqual(self.mock_get.call_count, 2)
+
+
+class FileOrURLToURLStorageTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.storage = FileSystemStorage(self.directory, '/media/')
+
+    def test_streamed(self):
+        reads = []
+
+        class TrackingIO(BytesIO):
+            def read(self, *args):
+                reads.append(args)
+                return super(TrackingIO, self).read(*args)
+        test_file = UploadedFile(TrackingIO(b'foobar'), 'file.txt',
+                                 'text/plain', 6)
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage)
+        self.assertEqual(field.clean([test_file, '']), '/media/TEST/file.txt')
+        self.assertNotIn((), reads)
+        with open(os.path.join(self.directory, 'TEST', 'file.txt'),
+                  'rb') as f:
+            self.assertEqual(f.read(), b'foobar')
+
+    def test_hash_names(self):
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, hash_names=True)
+        name = 'TEST/%s.txt' % hashlib.sha256(b'foobar').hexdigest()
+        first = field.clean([SimpleUploadedFile('a.TXT', b'foobar'), ''])
+        self.assertEqual(first, '/media/' + name)
+        with patch.object(self.storage, 'save') as mock_save:
+            second = field.clean([SimpleUploadedFile('b.txt', b'foobar'),
+                                  ''])
+        self.assertEqual(second, first)
+        self.assertFalse(mock_save.called)
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'TEST')),
+                         [name.split('/')[1]])
+
+
+class SigningStorage(FileSystemStorage):
+    """ Stand-in for a django-storages backend signing its URLs """
+    querystring_auth = True
+
+    def __init__(self, *args, **kwargs):
+        super(SigningStorage, self).__init__(*args, **kwargs)
+        self.signed = 0
+
+    def url(self, name):
+        url = super(SigningStorage, self).url(name)
+        if self.querystring_auth:
+            self.signed += 1
+            url += '?signature=%d' % self.signed
+        return url
+
+
+class StorageURLTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = SigningStorage(self.directory, '/media/')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def clean(self, field, name='file.txt'):
+        return field.clean([SimpleUploadedFile(name, b'foobar'), ''])
+
+    def test_no_aws_qs_leaves_storage_alone(self):
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, no_aws_qs=True)
+        self.assertEqual(self.clean(field), '/media/TEST/file.txt')
+        self.assertTrue(self.storage.querystring_auth)
+        signed = FileOrURLField(to='url', upload_to='TEST',
+                                storage=self.storage)
+        self.assertEqual(self.clean(signed, 'other.txt'),
+                         '/media/TEST/other.txt?signature=1')
+
+    def test_no_aws_qs_default_storage(self):
+        from django.core.files.storage import default_storage
+        with override_settings(MEDIA_ROOT=self.directory):
+            field = FileOrURLField(to='url', upload_to='TEST',
+                                   no_aws_qs=True)
+            self.clean(field)
+        self.assertFalse(hasattr(default_storage, 'querystring_auth'))
+
+    def test_url_cache_ttl(self):
+        field = FileOrURLField(to='url', upload_to='TEST', hash_names=True,
+                               storage=self.storage, url_cache_ttl=60)
+        first = self.clean(field)
+        self.assertEqual(self.clean(field), first)
+        self.assertEqual(self.storage.signed, 1)
+        with patch('time.time', return_value=time.time() + 61):
+            self.assertNotEqual(self.clean(field), first)
+        self.assertEqual(self.storage.signed, 2)
+
+    def test_concurrent_fields(self):
+        unsigned = FileOrURLField(to='url', upload_to='TEST',
+                                  storage=self.storage, no_aws_qs=True)
+        signed = FileOrURLField(to='url', upload_to='TEST',
+                                storage=self.storage)
+        results = []
+
+        def run(field):
+            for i in range(20):
+                results.append((field, self.clean(field, '%d.txt' % i)))
+        threads = [threading.Thread(target=run, args=(f,))
+                   for f in (unsigned, signed, unsigned, signed)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for field, url in results:
+            self.assertEqual('?signature=' in url, field is signed)
+
+
+class DeferredFileOrURLToURLTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.storage = FileSystemStorage(self.directory, '/media/')
+
+    def test_immediate_executor(self):
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, deferred=True,
+                               executor=ImmediateExecutor())
+        url = field.clean([SimpleUploadedFile('file.txt', b'foobar'), ''])
+        self.assertIsInstance(url, PendingURL)
+        self.assertRegex(url, r'^/media/TEST/[0-9a-f]{32}/file\.txt$')
+        self.assertTrue(url.done())
+        self.assertEqual(url.wait(), url)
+        with self.storage.open(url[len('/media/'):]) as f:
+            self.assertEqual(f.read(), b'foobar')
+
+    def test_same_names(self):
+        executor = ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, deferred=True,
+                               executor=executor)
+        first = field.clean([SimpleUploadedFile('p.txt', b'first'), ''])
+        second = field.clean([SimpleUploadedFile('p.txt', b'second'), ''])
+        self.assertNotEqual(first, second)
+        for url, data in ((first, b'first'), (second, b'second')):
+            url.wait(5)
+            with self.storage.open(url[len('/media/'):]) as f:
+                self.assertEqual(f.read(), data)
+
+    def test_name_taken(self):
+        save = self.storage.save
+
+        def renaming_save(name, content):
+            self.storage.save = save
+            save(name, ContentFile(b'other'))
+            return save(name, content)
+        self.storage.save = renaming_save
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, deferred=True,
+                               executor=ImmediateExecutor())
+        url = field.clean([SimpleUploadedFile('file.txt', b'foobar'), ''])
+        self.assertRaises(DeferredSaveError, url.wait)
+        directory = url[len('/media/'):].rsplit('/', 1)[0]
+        self.assertEqual(self.storage.listdir(directory)[1], ['file.txt'])
+
+    def test_same_content_concurrently(self):
+        save = self.storage.save
+
+        def concurrent_save(name, content):
+            # an identical upload is saved right after the exists() check
+            self.storage.save = save
+            save(name, ContentFile(b'foobar'))
+            return save(name, content)
+        self.storage.save = concurrent_save
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, deferred=True,
+                               hash_names=True, executor=ImmediateExecutor())
+        url = field.clean([SimpleUploadedFile('file.txt', b'foobar'), ''])
+        self.assertEqual(url.wait(), url)
+        self.assertEqual(len(self.storage.listdir('TEST')[1]), 1)
+
+    def test_background_upload(self):
+        started = threading.Event()
+        release = threading.Event()
+        save = self.storage.save
+
+        def slow_save(name, content):
+            started.set()
+            release.wait(5)
+            return save(name, content)
+        self.storage.save = slow_save
+
+        class TestForm(forms.Form):
+            test_field = FileOrURLField(to='url', upload_to='TEST',
+                                        storage=self.storage, deferred=True)
+        test_file = SimpleUploadedFile('file.txt', b'foobar')
+        form = TestForm({}, {'test_field_0': test_file})
+        self.assertTrue(form.is_valid())
+        test_file.close()
+        url = form.cleaned_data['test_field']
+        self.assertRegex(url, r'^/media/TEST/[0-9a-f]{32}/file\.txt$')
+        started.wait(5)
+        self.assertFalse(url.done())
+        release.set()
+        url.wait(5)
+        with self.storage.open(url[len('/media/'):]) as f:
+            self.assertEqual(f.read(), b'foobar')
+
+    def test_upload_error(self):
+        def broken_save(name, content):
+            raise IOError
+        self.storage.save = broken_save
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, deferred=True,
+                               executor=ImmediateExecutor())
+        url = field.clean([SimpleUploadedFile('file.txt', b'foobar'), ''])
+        self.assertRaises(IOError, url.wait)
+
+    @override_settings(XORFORMFIELDS_UPLOAD_EXECUTOR=(
+        'xorformfields.forms.storage.ImmediateExecutor'))
+    def test_executor_setting(self):
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, deferred=True,
+                               hash_names=True)
+        url = field.clean([SimpleUploadedFile('file.txt', b'foobar'), ''])
+        self.assertTrue(url.done())
+        self.assertTrue(self.storage.exists(url[len('/media/'):]))
+
+
+class RateLimitTestCase(TestCase):
+    def clean(self, field, url='http://example.com/a'):
+        try:
+            field.clean(['', url])
+        except forms.ValidationError as e:
+            return e.messages
+        return []
+
+    @patch('requests.Session.get')
+    def test_token_bucket(self, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: MockResp(b'foo')
+        field = FileOrURLField(to='file',
+                               rate_limiter=RateLimiter(rate=0.01, burst=2))
+        self.assertEqual(self.clean(field), [])
+        self.assertEqual(self.clean(field), [])
+        self.assertEqual(self.clean(field),
+                         [FileOrURLField.url_rate_limited_error])
+        self.assertEqual(mock_get.call_count, 2)
+        # other hosts have their own budget
+        self.assertEqual(self.clean(field, 'http://example.org/a'), [])
+
+    @patch('requests.Session.get')
+    def test_host_policy(self, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: MockResp(b'foo')
+        field = FileOrURLField(to='file', rate_limiter=RateLimiter(
+            hosts={'Example.com': {'rate': 0.01, 'burst': 1}}))
+        self.assertEqual(self.clean(field), [])
+        self.assertEqual(self.clean(field),
+                         [FileOrURLField.url_rate_limited_error])
+        for _ in range(3):
+            self.assertEqual(self.clean(field, 'http://example.org/a'), [])
+
+    @patch('requests.Session.get')
+    def test_waits_for_token(self, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: MockResp(b'foo')
+        field = FileOrURLField(to='file', rate_limiter=RateLimiter(
+            rate=50, burst=1, max_wait=1))
+        start = time.time()
+        self.assertEqual(self.clean(field), [])
+        self.assertEqual(self.clean(field), [])
+        self.assertGreaterEqual(time.time() - start, 0.015)
+
+    @patch('requests.Session.get')
+    def test_wait_indefinitely(self, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: MockResp(b'foo')
+        field = FileOrURLField(to='file', rate_limiter=RateLimiter(
+            rate=50, burst=1, max_wait=None))
+        for _ in range(3):
+            self.assertEqual(self.clean(field), [])
+        limiter = RateLimiter(max_concurrency=1, max_wait=None)
+        field = FileOrURLField(to='file', rate_limiter=limiter)
+        events = []
+
+        def fetch_url():
+            events.append(('fetched', self.clean(field)))
+        with limiter.limit('http://example.com/other'):
+            thread = threading.Thread(target=fetch_url)
+            thread.start()
+            time.sleep(0.02)
+            events.append('released')
+        thread.join(5)
+        # the fetch waited for the slot instead of being rejected
+        self.assertEqual(events, ['released', ('fetched', [])])
+
+    def test_invalid_policies(self):
+        for kwargs in ({'rate': 0}, {'rate': -1}, {'rate': 1, 'burst': -1},
+                       {'rate': 1, 'burst': 0.5}, {'max_concurrency': 0},
+                       {'max_wait': -1}, {'rate': '1'},
+                       {'hosts': {'example.com': {'rate': 0}}}):
+            self.assertRaises(ImproperlyConfigured, RateLimiter, **kwargs)
+        with override_settings(XORFORMFIELDS_RATE_LIMIT={
+                'OPTIONS': {'rate': 0}}):
+            field = FileOrURLField(to='file')
+            self.assertRaises(ImproperlyConfigured, self.clean, field)
+
+    def test_hosts_capped(self):
+        limiter = RateLimiter(rate=1000, burst=1, max_concurrency=1,
+                              max_hosts=10)
+        for i in range(100):
+            with limiter.limit('http://host%d.example.com/' % i):
+                pass
+        self.assertLessEqual(len(limiter._buckets), 10)
+        self.assertLessEqual(len(limiter._semaphores), 10)
+        # semaphores in use are kept
+        with limiter.limit('http://busy.example.com/'):
+            for i in range(100):
+                with limiter.limit('http://host%d.example.com/' % i):
+                    pass
+            self.assertIn('busy.example.com', limiter._semaphores)
+            self.assertRaises(fetch.FetchRateLimited, limiter.limit(
+                'http://busy.example.com/').__enter__)
+
+    @patch('requests.Session.get')
+    def test_concurrency(self, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: MockResp(b'foo')
+        limiter = RateLimiter(max_concurrency=1)
+        field = FileOrURLField(to='file', rate_limiter=limiter)
+        with limiter.limit('http://example.com/other'):
+            self.assertEqual(self.clean(field),
+                             [FileOrURLField.url_rate_limited_error])
+            self.assertEqual(self.clean(field, 'http://example.org/a'), [])
+        self.assertEqual(self.clean(field), [])
+
+    @patch('requests.Session.get')
+    def test_setting(self, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: MockResp(b'foo')
+        field = FileOrURLField(to='file')
+        with override_settings(XORFORMFIELDS_RATE_LIMIT={
+                'OPTIONS': {'rate': 0.01, 'burst': 1}}):
+            self.assertEqual(self.clean(field), [])
+            self.assertEqual(self.clean(field),
+                             [FileOrURLField.url_rate_limited_error])
+        self.assertEqual(self.clean(field), [])
+        disabled = FileOrURLField(to='file', rate_limiter=False)
+        with override_settings(XORFORMFIELDS_RATE_LIMIT={
+                'OPTIONS': {'rate': 0.01, 'burst': 1}}):
+            for _ in range(3):
+                self.assertEqual(self.clean(disabled), [])
+
+    @patch('requests.Session.get')
+    def test_cache_backed(self, mock_get):
+        mock_get.side_effect = lambda *args, **kwargs: MockResp(b'foo')
+        limiter = CacheRateLimiter(rate=0.001, burst=2,
+                                   key_prefix='test:%s' % time.time())
+        # a second process sharing the cache shares the budget
+        other = CacheRateLimiter(rate=0.001, burst=2,
+                                 key_prefix=limiter.key_prefix)
+        self.assertEqual(self.clean(FileOrURLField(
+            to='file', rate_limiter=limiter)), [])
+        self.assertEqual(self.clean(FileOrURLField(
+            to='file', rate_limiter=other)), [])
+        self.assertEqual(self.clean(FileOrURLField(
+            to='file', rate_limiter=limiter)),
+            [FileOrURLField.url_rate_limited_error])
+
+
+class StubResolver(object):
+    """ getaddrinfo() answering from `hosts`, counting lookups """
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.lookups = 0
+
+    def __call__(self, host, port, family=0, type=0):
+        self.lookups += 1
+        if host not in self.hosts:
+            raise socket.gaierror(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (a, port))
+                for a in self.hosts[host]]
+
+
+class HostHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.headers['Host'].encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ResolverTestCase(TestCase):
+    def setUp(self):
+        self.stub = StubResolver({
+            'files.test': ['127.0.0.1'],
+            'internal.test': ['10.0.0.5'],
+            'public.test': ['93.184.216.34'],
+            'mixed.test': ['93.184.216.34', '192.168.1.1'],
+        })
+
+    def tearDown(self):
+        fetch.set_session(None)
+
+    def test_private_addresses_blocked(self):
+        resolver = Resolver(getaddrinfo=self.stub)
+        self.assertEqual(resolver.resolve('public.test'), ['93.184.216.34'])
+        for host in ('internal.test', 'mixed.test', 'files.test',
+                     '169.254.169.254', '[::1]', '::ffff:127.0.0.1',
+                     '224.0.0.1'):
+            with self.assertRaises(fetch.FetchAddressBlocked):
+                resolver.resolve(host)
+
+    def test_allow_and_deny(self):
+        resolver = Resolver(allow=['10.0.0.0/8'], deny=['93.184.216.0/24'],
+                            getaddrinfo=self.stub)
+        self.assertEqual(resolver.resolve('internal.test'), ['10.0.0.5'])
+        self.assertEqual(resolver.resolve('192.168.1.1'), ['192.168.1.1'])
+        with self.assertRaises(fetch.FetchAddressBlocked):
+            resolver.resolve('public.test')
+
+    def test_lookups_cached(self):
+        resolver = Resolver(ttl=60, getaddrinfo=self.stub)
+        resolver.resolve('public.test')
+        resolver.resolve('Public.test.')
+        self.assertEqual(self.stub.lookups, 1)
+        with patch('xorformfields.forms.resolver.time.time',
+                   return_value=time.time() + 61):
+            resolver.resolve('public.test')
+        self.assertEqual(self.stub.lookups, 2)
+        # literal addresses aren't looked up
+        resolver.resolve('93.184.216.34')
+        self.assertEqual(self.stub.lookups, 2)
+
+    def test_connection_pinned(self):
+        server = HTTPServer(('127.0.0.1', 0), HostHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        resolver = Resolver(allow=['127.0.0.1/32'], getaddrinfo=self.stub)
+        field = FileOrURLField(to='file', session=fetch.build_session(
+            resolver=resolver, retries=0))
+        host = 'files.test:%d' % server.server_address[1]
+        for _ in range(2):
+            value = field.clean(['', 'http://%s/a.txt' % host])
+            # the request went to the stub's address, for the URL's host
+            self.assertEqual(value.read(), host.encode())
+        self.assertEqual(self.stub.lookups, 1)
+
+    def test_blocked_url(self):
+        field = FileOrURLField(to='file', session=fetch.build_session(
+            resolver=Resolver(getaddrinfo=self.stub), retries=0))
+        with self.assertRaises(forms.ValidationError) as cm:
+            field.clean(['', 'http://internal.test/a.txt'])
+        self.assertEqual(cm.exception.messages,
+                         [FileOrURLField.url_address_error])
+
+    def test_async_blocked_url(self):
+        # without its own client, aclean() goes through the pinned session
+        with override_settings(XORFORMFIELDS_RESOLVER={
+                'OPTIONS': {'getaddrinfo': self.stub}}):
+            field = FileOrURLField(to='file')
+            with self.assertRaises(forms.ValidationError) as cm:
+                asyncio.run(field.aclean(['', 'http://internal.test/a.txt']))
+        self.assertEqual(cm.exception.messages,
+                         [FileOrURLField.url_address_error])
+        self.assertEqual(self.stub.lookups, 1)
+
+    def test_resolver_from_settings(self):
+        adapter = fetch.get_session().get_adapter('http://example.com/')
+        self.assertIsInstance(adapter.resolver, Resolver)
+        self.assertIs(adapter.resolver, get_resolver())
+        with override_settings(XORFORMFIELDS_RESOLVER=None):
+            self.assertIsNone(get_resolver())
+            adapter = fetch.get_session().get_adapter('http://example.com/')
+            self.assertFalse(hasattr(adapter, 'resolver'))
+        with override_settings(XORFORMFIELDS_RESOLVER={
+                'OPTIONS': {'allow': ['10.0.0.0/8']}}):
+            self.assertTrue(get_resolver().is_allowed('10.1.2.3'))
+
+
+class ChunkProcessorsTestCase(TestCase):
+    png = b'\x89PNG\r\n\x1a\n' + b'x' * 100
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(self.directory, '/media/')
+        self.chunks = []
+        self.processors = [
+            HashProcessor(), HashProcessor('md5'), SniffProcessor(),
+            SizeLimitProcessor(1000),
+            CallbackProcessor(self.chunks.append, 'chunks',
+                              lambda: len(self.chunks))]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def expected(self, data):
+        return {
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'md5': hashlib.md5(data).hexdigest(),
+            'content_type': 'image/png',
+            'size': len(data),
+            'chunks': len(self.chunks),
+        }
+
+    @patch('requests.Session.get')
+    def test_download(self, mock_get):
+        mock_get.return_value = MockResp(self.png)
+        field = FileOrURLField(to='file', processors=self.processors)
+        uploaded = field.clean(['', 'http://example.com/a.png'])
+        self.assertEqual(uploaded.processed, self.expected(self.png))
+        self.assertEqual(b''.join(self.chunks), self.png)
+        # a second file gets fresh processors
+        uploaded = field.clean(['', 'http://example.com/a.png'])
+        self.assertEqual(uploaded.processed['size'], len(self.png))
+
+    @patch('requests.Session.get')
+    def test_size_limit(self, mock_get):
+        mock_get.return_value = MockResp(self.png)
+        field = FileOrURLField(to='file', processors=[SizeLimitProcessor(
+            10, 'Too big')])
+        with self.assertRaises(forms.ValidationError) as cm:
+            field.clean(['', 'http://example.com/a.png'])
+        self.assertEqual(cm.exception.messages, ['Too big'])
+
+    def test_save_single_pass(self):
+        reads = []
+
+        class TrackingIO(BytesIO):
+            def read(self, *args):
+                reads.append(args)
+                return super(TrackingIO, self).read(*args)
+        test_file = UploadedFile(TrackingIO(self.png), 'a.png', 'image/png',
+                                 len(self.png))
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage,
+                               processors=self.processors)
+        url = field.clean([test_file, ''])
+        self.assertIsInstance(url, StoredURL)
+        self.assertEqual(url, '/media/TEST/a.png')
+        self.assertEqual(url.processed, self.expected(self.png))
+        self.assertEqual(len([r for r in reads if r]), 2)  # data and EOF
+
+    def test_hash_names_single_pass(self):
+        test_file = SimpleUploadedFile('a.png', self.png, 'image/png')
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, hash_names=True,
+                               processors=self.processors)
+        url = field.clean([test_file, ''])
+        self.assertEqual(url.processed, self.expected(self.png))
+        self.assertEqual(len(self.chunks), 1)
+        url = field.clean([SimpleUploadedFile('b.png', self.png), ''])
+        self.assertEqual(url.processed['sha256'],
+                         hashlib.sha256(self.png).hexdigest())
+
+    def test_deferred(self):
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, deferred=True,
+                               executor=ImmediateExecutor(),
+                               processors=self.processors)
+        url = field.clean([SimpleUploadedFile('a.png', self.png), ''])
+        self.assertIsInstance(url, PendingURL)
+        self.assertEqual(url.processed, self.expected(self.png))
+
+    def test_uploaded_file(self):
+        field = FileOrURLField(processors=self.processors)
+        uploaded = field.clean([SimpleUploadedFile('a.png', self.png), ''])
+        self.assertEqual(uploaded.processed, self.expected(self.png))
+
+    def stored(self):
+        path = os.path.join(self.directory, 'TEST')
+        return os.listdir(path) if os.path.isdir(path) else []
+
+    def test_rejected_upload_not_stored(self):
+        def reject(chunk):
+            raise forms.ValidationError('Rejected')
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage,
+                               processors=[CallbackProcessor(reject)])
+        with self.assertRaises(forms.ValidationError) as cm:
+            field.clean([SimpleUploadedFile('a.png', self.png), ''])
+        self.assertEqual(cm.exception.messages, ['Rejected'])
+        self.assertEqual(self.stored(), [])
+        # the name is still free
+        url = FileOrURLField(to='url', upload_to='TEST', storage=self.storage,
+                             ).clean([SimpleUploadedFile('a.png', b'a'), ''])
+        self.assertEqual(url, '/media/TEST/a.png')
+
+    def test_size_limit_before_save(self):
+        save = self.storage.save
+        self.storage.save = lambda *args: self.fail('saved')
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage, processors=[
+                                   SizeLimitProcessor(10, 'Too big')])
+        with self.assertRaises(forms.ValidationError) as cm:
+            field.clean([SimpleUploadedFile('a.png', self.png), ''])
+        self.assertEqual(cm.exception.messages, ['Too big'])
+        self.storage.save = save
+
+    def test_temporary_file_moved(self):
+        test_file = TemporaryUploadedFile('a.png', 'image/png',
+                                          len(self.png), None)
+        test_file.write(self.png)
+        test_file.seek(0)
+        path = test_file.temporary_file_path()
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage,
+                               processors=self.processors)
+        url = field.clean([test_file, ''])
+        self.assertEqual(url.processed, self.expected(self.png))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.stored(), ['a.png'])
+        test_file.close()
+
+    def test_rejected_temporary_file_deleted(self):
+        def reject(chunk):
+            raise forms.ValidationError('Rejected')
+        test_file = TemporaryUploadedFile('a.png', 'image/png',
+                                          len(self.png), None)
+        test_file.write(self.png)
+        test_file.seek(0)
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=self.storage,
+                               processors=[CallbackProcessor(reject)])
+        self.assertRaises(forms.ValidationError,
+                          field.clean, [test_file, ''])
+        self.assertEqual(self.stored(), [])
+        test_file.close()
+
+
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        self.collector = HistogramCollector(buckets=(1, 10))
+        self.collector.connect()
+        self.addCleanup(self.collector.disconnect)
+
+    @patch('requests.Session.get')
+    def test_fetch_and_clean(self, mock_get):
+        mock_get.return_value = MockResp(b'foobar')
+        field = FileOrURLField(to='file')
+        field.clean(['', 'http://example.com'])
+        mock_get.return_value = MockResp(status_code=404)
+        self.assertRaises(forms.ValidationError,
+                          field.clean, ['', 'http://example.com'])
+        stats = self.collector.snapshot()
+        self.assertEqual(stats['fetch']['ok']['count'], 1)
+        self.assertEqual(stats['fetch']['ok']['bytes'], 6)
+        self.assertEqual(stats['fetch']['ok']['buckets'],
+                         [(1, 1), (10, 1), (float('inf'), 1)])
+        self.assertEqual(stats['fetch']['error']['count'], 1)
+        self.assertEqual(stats['clean']['ok']['count'], 1)
+        self.assertEqual(stats['clean']['error']['count'], 1)
+
+    def test_clean_many(self):
+        field = MutuallyExclusiveValueField(
+            fields=[forms.IntegerField(), forms.IntegerField()])
+        field.clean_many([['1', ''], ['1', '2'], ['x', '']])
+        keyed = KeyedExclusiveValueField(fields=[
+            ('a', forms.IntegerField()), ('b', forms.IntegerField())])
+        keyed.clean_many([{'a': '1'}, {}])
+        stats = self.collector.snapshot()
+        self.assertEqual(stats['clean']['ok']['count'], 2)
+        self.assertEqual(stats['clean']['error']['count'], 3)
+
+    def test_storage(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        field = FileOrURLField(to='url', upload_to='TEST',
+                               storage=FileSystemStorage(directory))
+        field.clean([SimpleUploadedFile('file.txt', b'foobar'), ''])
+        stats = self.collector.snapshot()
+        self.assertEqual(stats['storage']['ok']['count'], 1)
+        self.assertEqual(stats['storage']['ok']['bytes'], 6)
+
+    @patch('requests.Session.get')
+    def test_signal(self, mock_get):
+        mock_get.return_value = MockResp(b'foobar')
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append((sender, kwargs))
+        fetch_finished.connect(receiver)
+        self.addCleanup(fetch_finished.disconnect, receiver)
+        field = FileOrURLField(to='file')
+        field.clean(['', 'http://example.com'])
+        sender, kwargs = received[0]
+        self.assertIs(sender, FileOrURLField)
+        self.assertIs(kwargs['field'], field)
+        self.assertEqual(kwargs['url'], 'http://example.com')
+        self.assertEqual(kwargs['outcome'], 'ok')
+        self.assertIsNone(kwargs['error'])
+        self.assertGreaterEqual(kwargs['duration'], 0)
+
+    def test_reset(self):
+        self.collector.observe('clean', 'ok', 0.5)
+        self.collector.reset()
+        self.assertEqual(self.collector.snapshot(), {})
+
+
+class ImportTimeTestCase(TestCase):
+    # time allowed to import xorformfields.forms once Django is loaded
+    max_import_time = 0.25
+    heavy_modules = ('requests', 'urllib3', 'httpx',
+                     'django.core.files.storage', 'concurrent.futures.thread')
+
+    def test_import_time(self):
+        script = (
+            'import json, sys, time\n'
+            'import django\n'
+            'django.setup()\n'
+            'import django.forms\n'
+            'loaded = set(sys.modules)\n'
+            'start = time.perf_counter()\n'
+            'import xorformfields.forms\n'
+            'elapsed = time.perf_counter() - start\n'
+            'print(json.dumps({"time": elapsed, "modules": sorted(\n'
+            '    set(sys.modules) - loaded)}))\n')
+        env = dict(os.environ,
+                   DJANGO_SETTINGS_MODULE='xorformfields.test_settings')
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         env=env)
+        result = json.loads(output.decode('utf-8'))
+        for module in self.heavy_modules:
+            self.assertNotIn(module, result['modules'])
+        self.assertLess(result['time'], self.max_import_time)
+
+
 class FileOrURLToURLBadConfTestCase(FileOrURLToURLTestCase):
     def test_no_upload_to(self):
         self.assertRaises(RuntimeError, FileOrURLField, to='url')
@@ -331,6 +1895,114 @@ class MutuallyExclusiveRadioWidgetTestCase(TestCase):
             'value="1" /></span></span>')
 
 
+class RenderRadioTestCase(TestCase):
+    def test_render_radio(self):
+        self.assertHTMLEqual(render_radio('test_radio', False),
+                             '<input name="test_radio" type="radio" />')
+        self.assertHTMLEqual(
+            render_radio('test_radio', True),
+            '<input checked="" name="test_radio" type="radio" />')
+
+    def test_cached(self):
+        render_radio('test_radio', True)
+        with patch.object(RadioInput, 'render') as mock_render:
+            render_radio('test_radio', True)
+        self.assertFalse(mock_render.called)
+
+    def test_renderer_cached(self):
+        w = MutuallyExclusiveRadioWidget(widgets=[
+            forms.TextInput(), forms.TextInput()])
+        w.render('test', None)
+        with patch.object(RadioInput, 'render') as mock_render:
+            w.render('test', ['', '1'])
+        self.assertFalse(mock_render.called)
+
+
+class MutuallyExclusiveRadioWidgetTemplateTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.widget = MutuallyExclusiveRadioWidget(widgets=[
+            forms.TextInput(), forms.TextInput()])
+
+    def templates(self, dirs=()):
+        return override_settings(
+            INSTALLED_APPS=['django.forms', 'xorformfields'],
+            FORM_RENDERER='django.forms.renderers.TemplatesSetting',
+            TEMPLATES=[{
+                'BACKEND': 'django.template.backends.django.DjangoTemplates',
+                'DIRS': list(dirs),
+                'APP_DIRS': True,
+            }])
+
+    def test_templates_setting(self):
+        with self.templates():
+            self.assertHTMLEqual(
+                self.widget.render('test', ['', '1']),
+                '<span id="test_container" class="mutually-exclusive-widget" '
+                'style="display:inline-block">'
+                '<span><input name="test_radio" type="radio" />'
+                '<input name="test_0" type="text" /></span><br><span>'
+                '<input checked="" name="test_radio" type="radio" />'
+                '<input name="test_1" type="text" value="1" />'
+                '</span></span>')
+
+    def test_override_template(self):
+        template_dir = os.path.join(self.directory, 'xorformfields',
+                                    'widgets')
+        os.makedirs(template_dir)
+        with open(os.path.join(template_dir, 'mutually_exclusive_radio.html'),
+                  'w') as f:
+            f.write('<ul>{% for widget in widget.subwidgets %}'
+                    '<li>{{ widget.radio }}{% include widget.template_name %}'
+                    '</li>{% endfor %}</ul>')
+        with self.templates([self.directory]):
+            self.assertHTMLEqual(
+                self.widget.render('test', None),
+                '<ul><li><input checked="" name="test_radio" type="radio" />'
+                '<input name="test_0" type="text" /></li>'
+                '<li><input name="test_radio" type="radio" />'
+                '<input name="test_1" type="text" /></li></ul>')
+
+
+class FileLimitsTestCase(TestCase):
+    def setUp(self):
+        self.field = FileOrURLField(
+            max_size=10, allowed_content_types=['image/*', 'text/plain'])
+
+    def test_widget_attrs(self):
+        html = self.field.widget.render('test', None)
+        self.assertIn('accept="image/*,text/plain"', html)
+        self.assertIn('data-max-size="10"', html)
+        self.assertIn('data-max-size-error="%s"' %
+                      FileOrURLField.file_too_large_error, html)
+        self.assertIn('data-content-type-error="%s"' %
+                      FileOrURLField.file_content_type_error, html)
+        # the URL input isn't limited
+        self.assertEqual(html.count('data-max-size='), 1)
+        self.assertNotIn('accept=', FileOrURLField().widget.render('t', None))
+
+    def test_media(self):
+        media = str(self.field.widget.media)
+        self.assertIn('mutually_exclusive_widget.js', media)
+        if djversion >= 5.2:
+            self.assertIn(' defer', media)
+
+    def test_uploaded_file_checked(self):
+        upload = SimpleUploadedFile('a.txt', b'0123456789', 'text/plain')
+        self.assertIs(self.field.clean([upload, '']), upload)
+        with self.assertRaises(forms.ValidationError) as cm:
+            self.field.clean([SimpleUploadedFile(
+                'a.txt', b'0123456789A', 'text/plain'), ''])
+        self.assertEqual(cm.exception.messages,
+                         [FileOrURLField.file_too_large_error])
+        with self.assertRaises(forms.ValidationError) as cm:
+            self.field.clean([SimpleUploadedFile(
+                'a.html', b'<p>', 'text/html'), ''])
+        self.assertEqual(cm.exception.messages,
+                         [FileOrURLField.file_content_type_error])
+
+
 class FileOrURLWidgetTestCase(TestCase):
     test_file = InMemoryUploadedFile(
         StringIO(' '), None, 'file', 'text/plain', 1, None)
@@ -410,3 +2082,172 @@ class FileOrURLWidgetTestCase(TestCase):
         w = FileOrURLWidget()
         w.value_from_datadict({'test': self.test_file}, {}, 'test')
         w.value_from_datadict({}, {'test': 'http://example.com'}, 'test')
+
+
+def upload_key_required(request):
+    return request.META.get('HTTP_X_UPLOAD_KEY') == 'secret'
+
+
+class ChunkedUploadTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(XORFORMFIELDS_CHUNKED_UPLOADS={
+            'OPTIONS': {'directory': self.directory, 'max_size': 100}})
+        self.settings.enable()
+        self.base_url = '/xorformfields/uploads/'
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def create(self, size=10):
+        resp = self.client.post(self.base_url, {
+            'name': '../file.txt', 'size': size,
+            'content_type': 'text/plain'})
+        self.assertEqual(resp.status_code, 201)
+        return resp.json()['token']
+
+    def put(self, token, first, data, size=10):
+        return self.client.put(
+            '%s%s/' % (self.base_url, token), data,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes %d-%d/%d' % (
+                first, first + len(data) - 1, size))
+
+    def test_upload(self):
+        token = self.create()
+        resp = self.put(token, 0, b'01234')
+        self.assertEqual(resp.json(), {'offset': 5, 'size': 10})
+        self.assertIsNone(get_upload_store().open(token))
+        resp = self.put(token, 5, b'56789')
+        self.assertEqual(resp['Upload-Offset'], '10')
+        upload = get_upload_store().open(token)
+        self.assertEqual(upload.name, 'file.txt')
+        self.assertEqual(upload.size, 10)
+        self.assertEqual(upload.read(), b'0123456789')
+        upload.close()
+
+    def test_resume(self):
+        token = self.create()
+        self.put(token, 0, b'01234')
+        resp = self.client.get('%s%s/' % (self.base_url, token))
+        self.assertEqual(resp.json()['offset'], 5)
+        # a chunk sent again after a lost response
+        resp = self.put(token, 0, b'01234')
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['offset'], 5)
+
+    def test_interrupted_chunk(self):
+        store = get_upload_store()
+        token = store.create('file.txt', 10)
+        with self.assertRaises(UploadOffsetError) as cm:
+            store.write(token, 0, BytesIO(b'012'), 5)
+        self.assertEqual(cm.exception.offset, 3)
+        self.assertEqual(store.write(token, 3, BytesIO(b'3456789'), 7), 10)
+        self.assertEqual(store.open(token).read(), b'0123456789')
+
+    def test_invalid(self):
+        resp = self.client.post(self.base_url, {'size': 101})
+        self.assertEqual(resp.status_code, 413)
+        resp = self.client.post(self.base_url, {'size': 'x'})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.put('0' * 32, 0, b'01234')
+        self.assertEqual(resp.status_code, 404)
+        token = self.create()
+        resp = self.put(token, 8, b'01234')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.put(token, 0, b'01234', size=11)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_default_max_size(self):
+        store = ChunkedUploadStore(self.directory)
+        self.assertRaises(UploadError, store.create, 'file.txt', 10 ** 15)
+
+    def test_permission(self):
+        with override_settings(XORFORMFIELDS_CHUNKED_UPLOADS={
+                'OPTIONS': {'directory': self.directory},
+                'PERMISSION': 'xorformfields.tests.upload_key_required'}):
+            resp = self.client.post(self.base_url, {'size': 10})
+            self.assertEqual(resp.status_code, 403)
+            self.assertFalse(os.listdir(self.directory))
+            resp = self.client.post(self.base_url, {'size': 10},
+                                    HTTP_X_UPLOAD_KEY='secret')
+            self.assertEqual(resp.status_code, 201)
+
+    def test_status_after_move(self):
+        token = self.create()
+        self.put(token, 0, b'0123456789')
+        # storages move finished uploads away with temporary_file_path()
+        os.remove(get_upload_store().open(token).temporary_file_path())
+        resp = self.client.get('%s%s/' % (self.base_url, token))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_cleanup(self):
+        store = ChunkedUploadStore(self.directory, expiry=-1)
+        token = store.create('file.txt', 10)
+        store.cleanup()
+        self.assertIsNone(store.get_meta(token))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_widget(self):
+        widget = FileOrURLWidget(chunked=True, chunk_size=5)
+        html = widget.render('test', None)
+        self.assertIn('data-chunked-upload="%s"' % self.base_url, html)
+        self.assertIn('data-chunk-size="5"', html)
+        self.assertIn('data-token-name="test_token"', html)
+        media = str(widget.media)
+        # the file checks have to run before the upload starts
+        self.assertLess(media.index('mutually_exclusive_widget.js'),
+                        media.index('chunked_upload.js'))
+        self.assertNotIn('chunked_upload.js', str(FileOrURLWidget().media))
+
+    def test_field(self):
+        class TestForm(forms.Form):
+            test_field = FileOrURLField(to='url', upload_to='uploads',
+                                        storage=FileSystemStorage(
+                                            self.directory, '/media/'),
+                                        widget=FileOrURLWidget(chunked=True))
+        token = self.create()
+        self.put(token, 0, b'0123456789')
+        form = TestForm({'test_field_token': token}, {})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['test_field'],
+                         '/media/uploads/file.txt')
+        with open(os.path.join(self.directory, 'uploads', 'file.txt'),
+                  'rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+    def test_widget_opens_lazily(self):
+        token = self.create()
+        self.put(token, 0, b'0123456789')
+        widget = FileOrURLWidget(chunked=True)
+        data = {'test_token': token}
+        values = [widget.value_from_datadict(data, {}, 'test')
+                  for _ in range(3)]
+        for upload, url in values:
+            self.assertEqual(upload.size, 10)
+            self.assertTrue(upload.closed)
+        upload = values[0][0]
+        self.assertEqual(upload.read(), b'0123456789')
+        self.assertFalse(upload.closed)
+        upload.close()
+        self.assertTrue(upload.closed)
+
+    def test_plain_widget_ignores_token(self):
+        token = self.create()
+        self.put(token, 0, b'0123456789')
+        self.assertEqual(FileOrURLWidget().value_from_datadict(
+            {'test_token': token}, {}, 'test'), [None, None])
+
+        class TestForm(forms.Form):
+            test_field = FileOrURLField(to='file')
+        form = TestForm({'test_field_token': token}, {})
+        self.assertFalse(form.is_valid())
+
+    def test_field_unfinished(self):
+        class TestForm(forms.Form):
+            test_field = FileOrURLField(widget=FileOrURLWidget(chunked=True))
+        token = self.create()
+        self.put(token, 0, b'01234')
+        form = TestForm({'test_field_token': token}, {})
+        self.assertFalse(form.is_valid())
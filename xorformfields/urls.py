@@ -0,0 +1,16 @@
+"""
+Include these in your URLconf to enable chunked uploads:
+    path('xorformfields/', include('xorformfields.urls')),
+"""
+from django.urls import re_path
+
+from .views import chunked_upload
+
+
+app_name = 'xorformfields'
+
+urlpatterns = [
+    re_path(r'^uploads/$', chunked_upload, name='chunked_upload'),
+    re_path(r'^uploads/(?P<token>[0-9a-f]{32})/$', chunked_upload,
+            name='chunked_upload'),
+]
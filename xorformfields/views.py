@@ -0,0 +1,79 @@
+"""
+Endpoint receiving the chunked uploads of FileOrURLWidget(chunked=True).
+
+POST with `name`, `size` and `content_type` starts an upload and returns its
+token. Each chunk is then PUT to the upload's URL with a
+`Content-Range: bytes <first>-<last>/<size>` header, and GET/HEAD on it
+reports how many bytes arrived so that interrupted uploads can resume.
+Requests refused by upload_permitted() get a 403.
+"""
+import re
+
+from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods
+
+from .forms.uploads import (
+    UploadError, UploadOffsetError, get_upload_store, upload_permitted)
+
+
+__all__ = ['chunked_upload']
+
+_content_range_re = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def _status(offset, size, status=200):
+    response = JsonResponse({'offset': offset, 'size': size}, status=status)
+    response['Upload-Offset'] = str(offset)
+    return response
+
+
+@require_http_methods(['GET', 'HEAD', 'POST', 'PUT'])
+def chunked_upload(request, token=None):
+    if not upload_permitted(request):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    store = get_upload_store()
+    if token is None:
+        if request.method != 'POST':
+            return JsonResponse({'error': 'method not allowed'}, status=405)
+        try:
+            size = int(request.POST['size'])
+            if size < 0:
+                raise ValueError(size)
+            token = store.create(request.POST.get('name'), size,
+                                 request.POST.get('content_type'))
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'invalid size'}, status=400)
+        except UploadError:
+            return JsonResponse({'error': 'too large'}, status=413)
+        response = JsonResponse({'token': token, 'offset': 0, 'size': size},
+                                status=201)
+        response['Upload-Offset'] = '0'
+        return response
+
+    meta = store.get_meta(token)
+    if meta is None:
+        return JsonResponse({'error': 'unknown upload'}, status=404)
+    if request.method in ('GET', 'HEAD'):
+        try:
+            return _status(store.offset(token), meta['size'])
+        except UploadError:
+            # a storage already moved the finished upload away
+            return JsonResponse({'error': 'unknown upload'}, status=404)
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'method not allowed'}, status=405)
+
+    match = _content_range_re.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+    if match is None:
+        return JsonResponse({'error': 'invalid Content-Range'}, status=400)
+    first, last, size = map(int, match.groups())
+    length = last - first + 1
+    if (size != meta['size'] or length <= 0 or
+            request.META.get('CONTENT_LENGTH') != str(length)):
+        return JsonResponse({'error': 'invalid Content-Range'}, status=400)
+    try:
+        offset = store.write(token, first, request, length)
+    except UploadOffsetError as e:
+        return _status(e.offset, size, status=409)
+    except UploadError:
+        return JsonResponse({'error': 'invalid Content-Range'}, status=400)
+    return _status(offset, size)